@@ -0,0 +1,5 @@
+import os
+import sys
+
+# web modules import each other by bare name, the same way they are laid out in the docker image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web'))
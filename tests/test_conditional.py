@@ -0,0 +1,23 @@
+from conditional import etag_matches, not_modified_since
+
+
+def test_etag_matches_uses_weak_comparison():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"xyz", W/"abc"', etag)
+    assert not etag_matches('"xyz"', etag)
+    assert not etag_matches('abc', etag)
+
+
+def test_etag_matches_any():
+    assert etag_matches('*', '"abc"')
+    assert etag_matches(' * ', '"abc"')
+
+
+def test_not_modified_since():
+    # Tue, 01 Nov 2022 12:00:00 GMT
+    mtime = 1667304000.5
+    assert not_modified_since('Tue, 01 Nov 2022 12:00:00 GMT', mtime)
+    assert not not_modified_since('Tue, 01 Nov 2022 11:59:59 GMT', mtime)
+    assert not not_modified_since('yesterday', mtime)
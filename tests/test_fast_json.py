@@ -0,0 +1,12 @@
+import json
+
+import pytest
+
+pytest.importorskip('orjson')
+
+from bench_json import fast_path, make_rows, pydantic_path  # noqa: E402
+
+
+def test_fast_json_renders_the_same_json_as_pydantic():
+    rows = make_rows(4)
+    assert json.loads(fast_path(rows)) == json.loads(pydantic_path(rows))
@@ -9,3 +9,24 @@ def test_signature_verification():
     )
 
     assert address == '0x7DB4C793cECE6f1e586B8bc82ad5E6C0355AbB7E'
+
+
+def test_batch_signature_recovery_memoizes_valid_signatures():
+    import asyncio
+    from web.verification import SignatureRecovery
+
+    video_hash = '22c3754bd41827a484f397ba3d60a9beb36657253a0d09603729361611a47b27'
+    signature = '0x5049f171bfec251cc7ebdda8a80704df2d582cca2ef1347810285626bbc35f0d33df86414197814265c7c313752ff619bdcd8dd5b3c4800915020a402a5c3b271c'
+    recovery = SignatureRecovery(workers=1)
+    recovery.start()
+    try:
+        addresses = asyncio.run(recovery.get_addresses([
+            (video_hash, signature),
+            (video_hash, '0x00'),
+            (video_hash, signature),
+        ]))
+    finally:
+        recovery.stop()
+
+    assert addresses == ['0x7DB4C793cECE6f1e586B8bc82ad5E6C0355AbB7E', None, '0x7DB4C793cECE6f1e586B8bc82ad5E6C0355AbB7E']
+    assert recovery.stats()['size'] == 1
@@ -0,0 +1,29 @@
+from ttl_cache import LRUCache, MISSING
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set('a', 1, cache.generation)
+    cache.set('b', 2, cache.generation)
+    assert cache.get('a') == 1
+    cache.set('c', 3, cache.generation)
+
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 1
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(max_size=2, ttl=-1)
+    cache.set('a', 1, cache.generation)
+    assert cache.get('a') is MISSING
+
+
+def test_lru_cache_ignores_values_loaded_before_invalidation():
+    cache = LRUCache(max_size=2, ttl=60)
+    generation = cache.generation
+    cache.invalidate('a')
+    cache.set('a', 'stale', generation)
+    assert cache.get('a') is MISSING
@@ -0,0 +1,62 @@
+import asyncio
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from psycopg_pool import AsyncConnectionPool
+
+from migrate import apply_migrations
+from models import Location, Video, VideoRequest, VideoRequestManager
+
+# Must point to a disposable PostGIS database, migrations are applied to it
+PG_TEST_DSN = os.getenv('PG_TEST_DSN')
+
+pytestmark = pytest.mark.skipif(not PG_TEST_DSN, reason='PG_TEST_DSN is not set')
+
+
+def video_request(request_id, lat, long, reward):
+    return VideoRequest(
+        id=request_id,
+        block_number=1,
+        location=Location(lat=lat, long=long, direction=90, radius=0),
+        second_direction=180,
+        start_time=datetime(2022, 11, 1),
+        end_time=datetime(2022, 11, 2),
+        reward=reward,
+        address='0x7DB4C793cECE6f1e586B8bc82ad5E6C0355AbB7E',
+    )
+
+
+def test_request_cells_follow_inserts_and_uploads():
+    async def run():
+        await apply_migrations(PG_TEST_DSN)
+        async with AsyncConnectionPool(PG_TEST_DSN) as pool:
+            async with pool.connection() as conn:
+                await conn.execute('TRUNCATE video_request, request_cell')
+            manager = VideoRequestManager(pool)
+            await manager.add_requests([
+                video_request('1', 41.7151, 44.8271, Decimal(10)),
+                video_request('2', 41.7152, 44.8272, Decimal(5)),
+                video_request('3', 41.6168, 41.6367, Decimal(1)),
+            ], checkpoint='test', last_block=1)
+            await manager.add_video('1', Video(
+                uploader_address='0x7DB4C793cECE6f1e586B8bc82ad5E6C0355AbB7E',
+                location=Location(lat=41.7151, long=44.8271, direction=90, radius=0),
+                uploaded_at=datetime(2022, 11, 1, 12),
+                start_time=datetime(2022, 11, 1, 11),
+                end_time=datetime(2022, 11, 1, 11, 1),
+                file_hash='22c3754bd41827a484f397ba3d60a9beb36657253a0d09603729361611a47b27',
+            ))
+            return (
+                await manager.request_cells(zoom=15, min_lat=41.7, min_long=44.8, max_lat=41.8, max_long=44.9),
+                # summed from stored zoom levels
+                await manager.request_cells(zoom=0, min_lat=-90, min_long=-180, max_lat=90, max_long=180),
+            )
+
+    (cells, truncated), (world, world_truncated) = asyncio.run(run())
+    assert len(cells) == 1 and not truncated
+    assert (cells[0]['requests'], cells[0]['open'], cells[0]['fulfilled']) == (2, 1, 1)
+    assert cells[0]['reward'] == Decimal(15)
+    assert len(world) == 1 and not world_truncated
+    assert (world[0]['requests'], world[0]['fulfilled'], world[0]['reward']) == (3, 1, Decimal(16))
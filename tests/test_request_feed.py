@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('orjson')
+
+from feed import FEED_QUEUE_SIZE, RequestFeed, distance_meters  # noqa: E402
+
+
+def request_at(request_id, lat, long, video=None):
+    return {'id': request_id, 'location': {'lat': lat, 'long': long, 'direction': 0, 'radius': 0}, 'video': video}
+
+
+def test_distance_meters():
+    # one degree of latitude
+    assert distance_meters(41.0, 44.0, 42.0, 44.0) == pytest.approx(111_195, rel=1e-3)
+
+
+def test_events_reach_only_subscribers_of_the_area():
+    async def run():
+        feed = RequestFeed(manager=None)
+        tbilisi = feed.subscribe(41.7151, 44.8271, 1000)
+        batumi = feed.subscribe(41.6168, 41.6367, 1000)
+        feed.publish([request_at('1', 41.7160, 44.8280)])
+        return tbilisi, batumi
+
+    tbilisi, batumi = asyncio.run(run())
+    assert tbilisi.queue.get_nowait().startswith(b'event: requested\ndata: {"id":"1"')
+    assert batumi.queue.empty()
+
+
+def test_slow_subscriber_is_marked_lagged_without_blocking_others():
+    async def run():
+        feed = RequestFeed(manager=None)
+        slow = feed.subscribe(41.7151, 44.8271, 1000)
+        fast = feed.subscribe(41.7151, 44.8271, 1000)
+        for i in range(FEED_QUEUE_SIZE + 1):
+            feed.publish([request_at(str(i), 41.7151, 44.8271)])
+            fast.queue.get_nowait()
+        return slow
+
+    slow = asyncio.run(run())
+    assert slow.lagged
+    assert slow.queue.qsize() == FEED_QUEUE_SIZE
@@ -0,0 +1,34 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+import psycopg
+import pytest
+
+from migrate import apply_migrations
+from models import REQUESTS_BY_LOCATION_QUERY
+
+# Must point to a disposable PostGIS database, migrations are applied to it
+PG_TEST_DSN = os.getenv('PG_TEST_DSN')
+
+pytestmark = pytest.mark.skipif(not PG_TEST_DSN, reason='PG_TEST_DSN is not set')
+
+
+def test_requests_by_location_uses_geography_index():
+    asyncio.run(apply_migrations(PG_TEST_DSN))
+
+    with psycopg.connect(PG_TEST_DSN) as conn:
+        conn.execute('SET enable_seqscan = off')
+        cur = psycopg.ClientCursor(conn)
+        cur.execute('EXPLAIN (FORMAT JSON) ' + REQUESTS_BY_LOCATION_QUERY, {
+            'lat': 41.7,
+            'long': 44.8,
+            'radius': 1000,
+            'end_time': datetime(1970, 1, 1),
+            'since': datetime(1970, 1, 1),
+        })
+        plan = json.dumps(cur.fetchone()[0])
+
+    assert 'video_request_geog_idx' in plan
+    assert 'Seq Scan' not in plan
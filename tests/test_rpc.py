@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('web3')
+
+from rpc import JSONRPCClient, RPCError  # noqa: E402
+
+
+def stand_in_node(requests):
+    """Answers eth_blockNumber and fails every other method, batch responses come in reverse order."""
+
+    def answer(request):
+        if request['method'] == 'eth_blockNumber':
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': '0x10'}
+        return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32601, 'message': 'method not found'}}
+
+    def handler(http_request):
+        body = json.loads(http_request.content)
+        requests.append(body)
+        if isinstance(body, list):
+            return httpx.Response(200, json=[answer(request) for request in reversed(body)])
+        return httpx.Response(200, json=answer(body))
+
+    return httpx.MockTransport(handler)
+
+
+def test_batch_is_sent_in_one_request_and_keeps_order():
+    requests = []
+
+    async def run():
+        rpc = JSONRPCClient('http://node', transport=stand_in_node(requests))
+        try:
+            return await rpc.batch([('eth_blockNumber', []), ('eth_unknown', [1]), ('eth_blockNumber', [])])
+        finally:
+            await rpc.close()
+
+    block_number, error, same_block_number = asyncio.run(run())
+    assert len(requests) == 1
+    assert block_number == same_block_number == '0x10'
+    assert isinstance(error, RPCError)
+    assert error.code == -32601
+
+
+def test_call_raises_rpc_error():
+    async def run():
+        rpc = JSONRPCClient('http://node', transport=stand_in_node([]))
+        try:
+            assert await rpc.block_number() == 16
+            await rpc.call('eth_unknown')
+        finally:
+            await rpc.close()
+
+    with pytest.raises(RPCError):
+        asyncio.run(run())
+
+
+def test_rejected_batch_raises_rpc_error():
+    def handler(http_request):
+        # e.g. a provider limiting the batch size
+        return httpx.Response(200, json={
+            'jsonrpc': '2.0', 'id': None, 'error': {'code': -32005, 'message': 'batch too large'},
+        })
+
+    async def run():
+        rpc = JSONRPCClient('http://node', transport=httpx.MockTransport(handler))
+        try:
+            await rpc.batch([('eth_blockNumber', []), ('eth_blockNumber', [])])
+        finally:
+            await rpc.close()
+
+    with pytest.raises(RPCError) as exc_info:
+        asyncio.run(run())
+    assert exc_info.value.code == -32005
+
+
+def test_calls_missing_from_batch_response_are_errors():
+    def handler(http_request):
+        first = json.loads(http_request.content)[0]
+        return httpx.Response(200, json=[{'jsonrpc': '2.0', 'id': first['id'], 'result': '0x10'}])
+
+    async def run():
+        rpc = JSONRPCClient('http://node', transport=httpx.MockTransport(handler))
+        try:
+            return await rpc.batch([('eth_blockNumber', []), ('eth_gasPrice', [])])
+        finally:
+            await rpc.close()
+
+    block_number, error = asyncio.run(run())
+    assert block_number == '0x10'
+    assert isinstance(error, RPCError)
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip('eth_account')
+pytest.importorskip('web3')
+
+from submitter import NonceManager, nonce_gaps  # noqa: E402
+
+
+def test_nonce_gaps_below_waiting_transactions():
+    assert nonce_gaps(5, []) == []
+    assert nonce_gaps(5, [5, 6, 7]) == []
+    # 5 was lost, 6 and 8 can't be mined until it is used
+    assert nonce_gaps(5, [6, 8]) == [5, 7]
+    # mined nonces are below the pending count
+    assert nonce_gaps(9, [6, 8]) == []
+
+
+def test_released_nonces_are_reused_after_a_failed_batch():
+    nonces = NonceManager()
+    nonces.sync(chain_nonce=10, max_local_nonce=None)
+    taken = [nonces.take(), nonces.take()]
+    for nonce in taken:
+        nonces.release(nonce)
+    nonces.sync(chain_nonce=10, max_local_nonce=None)
+    assert [nonces.take(), nonces.take()] == [10, 11]
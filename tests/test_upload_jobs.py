@@ -0,0 +1,48 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from psycopg_pool import AsyncConnectionPool
+
+from jobs import UploadJobQueue
+from migrate import apply_migrations
+from models import Location, Video
+
+# Must point to a disposable PostGIS database, migrations are applied to it
+PG_TEST_DSN = os.getenv('PG_TEST_DSN')
+
+pytestmark = pytest.mark.skipif(not PG_TEST_DSN, reason='PG_TEST_DSN is not set')
+
+
+def test_job_is_claimed_by_one_worker_and_retried_later():
+    video = Video(
+        uploader_address='0x7DB4C793cECE6f1e586B8bc82ad5E6C0355AbB7E',
+        location=Location(lat=41.7, long=44.8, direction=90, radius=0),
+        uploaded_at=datetime(2022, 11, 1),
+        start_time=datetime(2022, 11, 1),
+        end_time=datetime(2022, 11, 1, 0, 1),
+        file_hash='22c3754bd41827a484f397ba3d60a9beb36657253a0d09603729361611a47b27',
+    )
+
+    async def run():
+        await apply_migrations(PG_TEST_DSN)
+        async with AsyncConnectionPool(PG_TEST_DSN, min_size=2) as pool:
+            async with pool.connection() as conn:
+                await conn.execute('DELETE FROM upload_job')
+            queue = UploadJobQueue(pool)
+            job_id = await queue.enqueue('1', video)
+
+            claimed = await asyncio.gather(queue.claim(), queue.claim())
+            jobs = [job for job in claimed if job is not None]
+            assert len(jobs) == 1
+            assert jobs[0].id == job_id
+            assert jobs[0].video == video
+
+            await queue.retry(jobs[0], 'verifier is down')
+            # the retry is delayed
+            assert await queue.claim() is None
+            job = await queue.get(job_id)
+            assert (job.status, job.attempts, job.last_error) == ('queued', 1, 'verifier is down')
+
+    asyncio.run(run())
@@ -0,0 +1,38 @@
+import asyncio
+import sqlite3
+
+from verifier.result_cache import SCHEMA_VERSION, VerificationCache
+
+
+def test_cache_without_mode_is_migrated(tmp_path):
+    path = str(tmp_path / 'verification.sqlite3')
+    with sqlite3.connect(path) as conn:
+        conn.execute('''
+            CREATE TABLE verification (
+                cid TEXT NOT NULL,
+                direction INTEGER NOT NULL,
+                second_direction INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (cid, direction, second_direction)
+            )
+        ''')
+        conn.execute('''INSERT INTO verification VALUES ('Qm', 0, 90, '{"is_verified": true}', 1.0)''')
+    conn.close()
+
+    cache = VerificationCache(path, memory_size=1)
+    assert asyncio.run(cache.get(('Qm', 0, 90, 'full'))) == {'is_verified': True}
+    assert asyncio.run(cache.get(('Qm', 0, 90, 'fast'))) is None
+    asyncio.run(cache.set(('Qm', 0, 90, 'fast'), {'is_verified': False}))
+
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    conn.close()
+
+
+def test_disk_tier_is_trimmed_periodically(tmp_path):
+    cache = VerificationCache(str(tmp_path / 'verification.sqlite3'), memory_size=1, disk_size=3, trim_interval=2)
+    for i in range(6):
+        asyncio.run(cache.set((str(i), 0, 90, 'full'), {'is_verified': True}))
+    assert asyncio.run(cache.stats())['disk_size'] == 3
+    assert asyncio.run(cache.get(('5', 0, 90, 'full'))) is not None
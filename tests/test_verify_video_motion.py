@@ -0,0 +1,72 @@
+import json
+import os
+import shutil
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from verifier.verifier import average_motion, verify_video
+
+# Directory with sample clips and expected.json recorded with the per-point loop implementation:
+# {"<clip file>": [direction, second_direction, direction_time, second_direction_time]}
+# The checked in clips are synthetic pans over a random texture, 90 and 45 degrees to the right.
+VERIFIER_SAMPLE_CLIPS_DIR = os.getenv(
+    'VERIFIER_SAMPLE_CLIPS_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'verifier_clips'),
+)
+
+
+def loop_average_motion(good_new, good_old):
+    x_deltas = []
+    y_deltas = []
+    for new, old in zip(good_new, good_old):
+        x1, y1 = new.ravel()
+        x2, y2 = old.ravel()
+        x_deltas.append(x2 - x1)
+        y_deltas.append(y1 - y2)
+    return sum(x_deltas) / len(x_deltas), sum(y_deltas) / len(y_deltas)
+
+
+@pytest.mark.skipif(
+    int(np.__version__.split('.')[0]) >= 2,
+    reason='the loop promotes differently on NumPy 2, the verifier pins NumPy 1.x',
+)
+@pytest.mark.parametrize('points', [1, 7, 100, 1000])
+def test_average_motion_matches_per_point_loop(points):
+    rng = np.random.default_rng(points)
+    good_old = rng.uniform(0, 1920, (points, 2)).astype(np.float32)
+    good_new = good_old + rng.normal(0, 5, (points, 2)).astype(np.float32)
+
+    # direction thresholds are exact comparisons, so the results must be bit-identical
+    actual = average_motion(good_new, good_old)
+    expected = loop_average_motion(good_new, good_old)
+    assert actual == expected
+    assert [value.dtype for value in actual] == [value.dtype for value in expected]
+
+
+def sample_clips():
+    with open(os.path.join(VERIFIER_SAMPLE_CLIPS_DIR, 'expected.json')) as f:
+        return sorted(json.load(f).items())
+
+
+@pytest.mark.skipif(not shutil.which('ffprobe'), reason='verify_video probes the clip with ffprobe')
+@pytest.mark.parametrize('clip, expected', sample_clips())
+def test_verify_video_matches_recorded_times(clip, expected):
+    direction, second_direction, direction_time, second_direction_time = expected
+
+    _, actual_direction_time, actual_second_direction_time, _ = verify_video(
+        os.path.join(VERIFIER_SAMPLE_CLIPS_DIR, clip), direction, second_direction,
+    )
+
+    assert (actual_direction_time, actual_second_direction_time) == (direction_time, second_direction_time)
+
+
+def test_is_decided_once_thresholds_are_met_or_unreachable():
+    from verifier.verifier import is_decided
+
+    assert is_decided(4001, 101, current_time=5000, duration_ms=None)
+    assert not is_decided(3000, 0, current_time=5000, duration_ms=None)
+    assert not is_decided(3000, 0, current_time=5000, duration_ms=10000)
+    assert is_decided(1000, 0, current_time=9000, duration_ms=10000)
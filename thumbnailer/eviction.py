@@ -0,0 +1,91 @@
+import logging
+import os
+import re
+import sys
+import time
+
+from render import VARIANTS, variant_file_name
+
+# Max total size of the thumbnails directory
+THUMBNAILS_BUDGET_BYTES = int(os.getenv('THUMBNAILS_BUDGET_BYTES', 5 * 1024 ** 3))
+THUMBNAILS_EVICTION_INTERVAL = float(os.getenv('THUMBNAILS_EVICTION_INTERVAL', 300))
+# Eviction frees space down to this share of the budget, so it doesn't run for every new thumbnail
+THUMBNAILS_EVICTION_LOW_WATERMARK = 0.9
+
+# Files being rendered, they are renamed once complete
+TMP_PREFIX = '.tmp-'
+
+# Single thumbnails rendered before variants existed, the same render as the 128 px PNG variant
+LEGACY_FILE_RE = re.compile(r'^(?P<cid>[A-Za-z0-9]+)\.png$')
+LEGACY_VARIANT = ('128', 'png')
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+def touch_access_time(path: str):
+    """Marks the file as recently used.
+
+    Volumes are usually mounted with relatime, so atime isn't reliably updated by reads.
+    mtime is kept since it's the Last-Modified of the thumbnail.
+    """
+    stat_result = os.stat(path)
+    os.utime(path, (time.time(), stat_result.st_mtime))
+
+
+def migrate_legacy_thumbnails(directory: str) -> int:
+    """Renames {cid}.png files to their variant name, or removes them when it's taken.
+
+    Nothing serves the legacy names anymore, they would only take space until evicted.
+    Returns the number of handled files.
+    """
+    handled = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            match = LEGACY_FILE_RE.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            target = os.path.join(directory, variant_file_name(match.group('cid'), LEGACY_VARIANT))
+            try:
+                if LEGACY_VARIANT in VARIANTS and not os.path.exists(target):
+                    os.replace(entry.path, target)
+                else:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            handled += 1
+    if handled:
+        logger.info(f'Migrated {handled} legacy thumbnails in {directory}')
+    return handled
+
+
+def evict_least_recently_used(directory: str, budget: int = THUMBNAILS_BUDGET_BYTES) -> int:
+    """Removes least recently accessed files once the directory exceeds `budget`, returns freed bytes."""
+    entries = []
+    total = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.startswith(TMP_PREFIX) or not entry.is_file():
+                continue
+            try:
+                stat_result = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat_result.st_atime, stat_result.st_size, entry.path))
+            total += stat_result.st_size
+
+    if total <= budget:
+        return 0
+
+    freed = 0
+    target = budget * THUMBNAILS_EVICTION_LOW_WATERMARK
+    for _, size, path in sorted(entries):
+        if total - freed <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        freed += size
+    logger.info(f'Evicted {freed} bytes of thumbnails from {directory}')
+    return freed
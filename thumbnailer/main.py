@@ -1,17 +1,38 @@
 import logging
+import os
+import re
 import sys
+import uuid
 from functools import partial
+from typing import Dict
 
 import asyncio
 import aiofiles
 import aiofiles.os
-import ffmpeg
-import httpx
 import uvicorn
 from fastapi import (
     FastAPI,
+    Header,
+)
+from fastapi.responses import FileResponse, JSONResponse, Response
+
+from conditional import etag_matches, not_modified_since
+from eviction import (
+    THUMBNAILS_EVICTION_INTERVAL,
+    TMP_PREFIX,
+    evict_least_recently_used,
+    migrate_legacy_thumbnails,
+    touch_access_time,
+)
+from http_client import create_http_client
+from render import (
+    MEDIA_TYPES,
+    THUMBNAIL_DEFAULT_SIZE,
+    VARIANTS,
+    Variant,
+    generate_thumbnails,
+    variant_file_name,
 )
-from fastapi.responses import StreamingResponse
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -19,7 +40,30 @@ logger = logging.getLogger()
 
 base_url = 'https://ipfs.objective.camera/{}'
 
+# Max number of thumbnails rendered at once, each one downloads a video and runs ffmpeg
+THUMBNAIL_CONCURRENCY = int(os.getenv('THUMBNAIL_CONCURRENCY', os.cpu_count() or 1))
+# A thumbnail evicted right after rendering is rendered again this many times at most
+THUMBNAIL_RENDER_ATTEMPTS = 2
+
+# seek: ffmpeg reads only the needed part of the video from /videos or over HTTP,
+# download: the whole video is downloaded first
+THUMBNAIL_SOURCE = os.getenv('THUMBNAIL_SOURCE', 'seek')
+# Seconds into the video the thumbnail is taken at
+THUMBNAIL_OFFSET = float(os.getenv('THUMBNAIL_OFFSET', 1))
+THUMBNAILS_DIR = os.getenv('THUMBNAILS_DIR', '/thumbnails')
+# {cid}_{size}.{format}, {cid}_preview.webp or {cid}.png
+THUMBNAIL_FILE_RE = re.compile(r'^(?P<cid>[A-Za-z0-9]+)(?:_(?P<size>\d+|preview))?\.(?P<fmt>png|webp)$')
+# Shared with the web service which stores uploaded videos named by their hash
+VIDEOS_DIR = os.getenv('VIDEOS_DIR', '/videos')
+
+# Client of the IPFS gateway kept for the app lifetime, limits and retries are set in http_client.py
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 60))
+
 app = FastAPI()
+http_client = None
+generation_semaphore = asyncio.Semaphore(THUMBNAIL_CONCURRENCY)
+# cid -> rendering task shared by all requests waiting for its thumbnails
+in_flight: Dict[str, asyncio.Task] = {}
 
 
 async def is_path_exists(path: str) -> bool:
@@ -33,40 +77,167 @@ async def is_path_exists(path: str) -> bool:
 
 
 async def get_original_video(url):
-    async with httpx.AsyncClient() as client:
-        return await client.get(url)
+    return await http_client.get(url)
+
+
+def thumbnail_path(cid: str, variant: Variant) -> str:
+    return os.path.join(THUMBNAILS_DIR, variant_file_name(cid, variant))
+
+
+def thumbnail_etag(cid: str, variant: Variant) -> str:
+    # thumbnails of a cid never change, so the name alone identifies the content
+    return f'"{variant_file_name(cid, variant)}"'
+
+
+async def render_thumbnails(cid: str):
+    """Renders every missing variant of the thumbnail in one ffmpeg pass."""
+    async with generation_semaphore:
+        # thumbnails could have been rendered while we were waiting for the semaphore
+        missing = [
+            variant for variant in VARIANTS
+            if not await is_path_exists(thumbnail_path(cid, variant))
+        ]
+        if not missing:
+            return
+        suffix = uuid.uuid4().hex
+        original_file_path = f'/tmp/{cid}-{suffix}.mp4'
+        tmp_paths = {
+            variant: os.path.join(THUMBNAILS_DIR, f'{TMP_PREFIX}{suffix}-{variant_file_name(cid, variant)}')
+            for variant in missing
+        }
+        try:
+            if THUMBNAIL_SOURCE == 'seek':
+                local_path = os.path.join(VIDEOS_DIR, cid)
+                source = local_path if await is_path_exists(local_path) else base_url.format(cid)
+            else:
+                resp = await get_original_video(base_url.format(cid))
+                resp.raise_for_status()
+                async with aiofiles.open(original_file_path, 'wb') as out_file:
+                    await out_file.write(resp.content)
+                source = original_file_path
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, partial(generate_thumbnails, source, tmp_paths, THUMBNAIL_OFFSET))
+            # readers never see a partially written thumbnail
+            for variant, tmp_path in tmp_paths.items():
+                await aiofiles.os.replace(tmp_path, thumbnail_path(cid, variant))
+        finally:
+            for path in [original_file_path, *tmp_paths.values()]:
+                if await is_path_exists(path):
+                    await aiofiles.os.remove(path)
+
+
+def log_rendering_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error('Thumbnail rendering failed', exc_info=task.exception())
+
+
+def start_rendering(cid: str) -> asyncio.Task:
+    """Returns the rendering task of the cid, there is at most one per cid at a time."""
+    task = in_flight.get(cid)
+    if task is None:
+        task = asyncio.ensure_future(render_thumbnails(cid))
+        in_flight[cid] = task
+        task.add_done_callback(lambda _: in_flight.pop(cid, None))
+        task.add_done_callback(log_rendering_error)
+    return task
+
+
+async def touch_rendered(cid: str, path: str) -> os.stat_result:
+    """Renders the thumbnails if needed and marks the file as used, returns its stat.
+
+    A file evicted between the check and the touch is a miss like any other and is rendered again.
+    Once touched it is the most recently used one, so eviction leaves it alone while it is sent.
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(THUMBNAIL_RENDER_ATTEMPTS):
+        if not await is_path_exists(path):
+            # a disconnected client must not cancel the rendering other clients wait for
+            await asyncio.shield(start_rendering(cid))
+        try:
+            await loop.run_in_executor(None, touch_access_time, path)
+            return await aiofiles.os.stat(path)
+        except FileNotFoundError:
+            if attempt == THUMBNAIL_RENDER_ATTEMPTS - 1:
+                raise
+
+
+@app.get('/thumbnails/{file_name}')
+async def thumbnail(
+        file_name: str,
+        if_none_match: str = Header(None),
+        if_modified_since: str = Header(None),
+):
+    match = THUMBNAIL_FILE_RE.match(file_name)
+    if not match:
+        return JSONResponse(status_code=404)
+    cid = match.group('cid')
+    # /thumbnails/{cid}.png is the original single thumbnail URL
+    variant = (match.group('size') or str(THUMBNAIL_DEFAULT_SIZE), match.group('fmt'))
+    if variant not in VARIANTS:
+        return JSONResponse(status_code=404)
+
+    path = thumbnail_path(cid, variant)
+    etag = thumbnail_etag(cid, variant)
+    loop = asyncio.get_running_loop()
+    # revalidation by ETag doesn't even need the file to be there
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        try:
+            await loop.run_in_executor(None, touch_access_time, path)
+        except FileNotFoundError:
+            pass
+        return Response(status_code=304, headers={'etag': etag})
+
+    stat_result = await touch_rendered(cid, path)
+    if if_none_match is None and if_modified_since is not None \
+            and not_modified_since(if_modified_since, stat_result.st_mtime):
+        return Response(status_code=304, headers={'etag': etag})
+
+    # FileResponse sets Content-Length and Last-Modified from stat_result.
+    # Under uvicorn it reads and sends the file in chunks, there is no sendfile,
+    # which is fine for files of a few KB.
+    return FileResponse(
+        path,
+        stat_result=stat_result,
+        headers={'etag': etag},
+        media_type=MEDIA_TYPES[variant[1]],
+    )
 
 
-def iterfile(thumbnail_path):
-    with open(thumbnail_path, mode="rb") as file_like:
-        yield from file_like
+@app.post('/internal/thumbnails/{cid}')
+async def pregenerate_thumbnails(cid: str):
+    """Called right after an upload so that the first viewer doesn't wait for rendering."""
+    start_rendering(cid)
+    return JSONResponse(status_code=202, content={})
 
 
-def generate_thumbnail(original_file_path: str, thumbnail_path: str):
-    result = (
-        ffmpeg
-        .input(original_file_path)
-        .filter('scale', 128, -1)
-        .output(thumbnail_path, vframes=1)
-        .overwrite_output()
-        .run(capture_stdout=True, capture_stderr=True)
-    )
-    return result
-
-
-@app.get('/thumbnails/{cid}.png')
-async def thumbnail(cid: str):
-    thumbnail_path = f'/thumbnails/{cid}.png'
-    if await is_path_exists(thumbnail_path):
-        return StreamingResponse(iterfile(thumbnail_path), media_type="image/png")
-    resp = await get_original_video(base_url.format(cid))
-    original_file_path = f'/tmp/{cid}.mp4'
-    async with aiofiles.open(original_file_path, 'wb') as out_file:
-        await out_file.write(resp.content)
+async def evict_thumbnails():
     loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, partial(generate_thumbnail, original_file_path, thumbnail_path))
-    await aiofiles.os.remove(original_file_path)
-    return StreamingResponse(iterfile(thumbnail_path), media_type="image/png")
+    try:
+        await loop.run_in_executor(None, migrate_legacy_thumbnails, THUMBNAILS_DIR)
+    except Exception as e:
+        logger.exception(e)
+    while True:
+        try:
+            await loop.run_in_executor(None, evict_least_recently_used, THUMBNAILS_DIR)
+        except Exception as e:
+            logger.exception(e)
+        await asyncio.sleep(THUMBNAILS_EVICTION_INTERVAL)
+
+
+@app.on_event("startup")
+def schedule_eviction():
+    asyncio.get_event_loop().create_task(evict_thumbnails())
+
+
+@app.on_event("startup")
+def open_http_client():
+    global http_client
+    http_client = create_http_client(timeout=HTTP_TIMEOUT)
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
 
 
 if __name__ == "__main__":
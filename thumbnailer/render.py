@@ -0,0 +1,60 @@
+import os
+from typing import Dict, List, Tuple
+
+import ffmpeg
+
+THUMBNAIL_SIZES = [int(size) for size in os.getenv('THUMBNAIL_SIZES', '128,320,640').split(',')]
+THUMBNAIL_FORMATS = os.getenv('THUMBNAIL_FORMATS', 'webp,png').split(',')
+# Served for the legacy /thumbnails/{cid}.png
+THUMBNAIL_DEFAULT_SIZE = int(os.getenv('THUMBNAIL_DEFAULT_SIZE', 128))
+
+PREVIEW = 'preview'
+PREVIEW_WIDTH = int(os.getenv('THUMBNAIL_PREVIEW_WIDTH', 320))
+PREVIEW_SECONDS = float(os.getenv('THUMBNAIL_PREVIEW_SECONDS', 3))
+PREVIEW_FPS = int(os.getenv('THUMBNAIL_PREVIEW_FPS', 10))
+
+MEDIA_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+# (variant, format), variant is a width in pixels or PREVIEW for a short animated clip
+Variant = Tuple[str, str]
+
+VARIANTS: List[Variant] = [
+    (str(size), fmt)
+    for size in THUMBNAIL_SIZES
+    for fmt in THUMBNAIL_FORMATS
+] + [(PREVIEW, 'webp')]
+
+
+def variant_file_name(cid: str, variant: Variant) -> str:
+    size, fmt = variant
+    return f'{cid}_{size}.{fmt}'
+
+
+def generate_thumbnails(source: str, paths: Dict[Variant, str], offset: float = 0):
+    """Renders all variants in `paths` with a single ffmpeg run over a local file or an HTTP URL.
+
+    Seeking on the input makes ffmpeg jump to the nearest keyframe, over HTTP it
+    uses range requests, so only the bytes of the rendered frames and the index are read.
+    """
+    branches = ffmpeg.input(source, ss=offset).video.filter_multi_output('split')
+    outputs = []
+    for i, ((size, fmt), path) in enumerate(paths.items()):
+        if size == PREVIEW:
+            outputs.append(
+                branches[i]
+                .filter('fps', PREVIEW_FPS)
+                .filter('scale', PREVIEW_WIDTH, -1)
+                .output(path, t=PREVIEW_SECONDS, loop=0)
+            )
+        else:
+            outputs.append(branches[i].filter('scale', int(size), -1).output(path, vframes=1))
+    result = ffmpeg.merge_outputs(*outputs).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+
+    rendered = all(os.path.exists(path) and os.path.getsize(path) > 0 for path in paths.values())
+    if offset and not rendered:
+        # the clip is shorter than the offset
+        return generate_thumbnails(source, paths)
+    return result
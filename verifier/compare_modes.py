@@ -0,0 +1,61 @@
+"""Compares fast verification settings against the full mode on sample clips.
+
+The clips directory must contain expected.json in the format used by
+tests/test_verify_video_motion.py:
+{"<clip file>": [direction, second_direction, direction_time, second_direction_time]}
+
+Usage: python compare_modes.py <clips dir> [--strides 1 2 3] [--scales 1 0.5] [--min-features 0 30]
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+from verifier import FULL_MODE, verify_video
+
+
+def run(clips_dir, clips, params):
+    results = {}
+    started_at = time.monotonic()
+    for clip, (direction, second_direction, *_) in clips:
+        is_verified, direction_time, second_direction_time, _ = verify_video(
+            os.path.join(clips_dir, clip), direction, second_direction, **params,
+        )
+        results[clip] = (is_verified, direction_time, second_direction_time)
+    return results, time.monotonic() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares fast verification settings against the full mode.')
+    parser.add_argument('clips_dir')
+    parser.add_argument('--strides', type=int, nargs='+', default=[1, 2, 3, 4])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.5, 0.25])
+    parser.add_argument('--min-features', type=int, nargs='+', default=[0, 30])
+    args = parser.parse_args()
+
+    with open(os.path.join(args.clips_dir, 'expected.json')) as f:
+        clips = sorted(json.load(f).items())
+
+    full_results, full_seconds = run(args.clips_dir, clips, FULL_MODE)
+
+    rows = []
+    for frame_stride, scale, min_features in itertools.product(args.strides, args.scales, args.min_features):
+        params = dict(frame_stride=frame_stride, scale=scale, min_features=min_features)
+        results, seconds = run(args.clips_dir, clips, params)
+        same_verdict = sum(results[clip][0] == full_results[clip][0] for clip in results)
+        direction_error = sum(abs(results[clip][1] - full_results[clip][1]) for clip in results) / len(results)
+        second_direction_error = sum(abs(results[clip][2] - full_results[clip][2]) for clip in results) / len(results)
+        rows.append((frame_stride, scale, min_features, same_verdict, direction_error, second_direction_error, full_seconds / seconds))
+
+    print(f'{len(clips)} clips, full mode took {full_seconds:.1f}s')
+    print('stride  scale  min_features  same_verdict  direction_time_err_ms  second_direction_time_err_ms  speedup')
+    for frame_stride, scale, min_features, same_verdict, direction_error, second_direction_error, speedup in rows:
+        print(
+            f'{frame_stride:>6}  {scale:>5}  {min_features:>12}  {same_verdict:>8}/{len(clips):<3}  '
+            f'{direction_error:>21.1f}  {second_direction_error:>28.1f}  {speedup:>6.2f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,31 @@
 import logging
+import multiprocessing
+import os
 import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from functools import partial
 
 import asyncio
 import aiofiles
 import aiofiles.os
 import ffmpeg
-import httpx
 import uvicorn
 from fastapi import (
     FastAPI,
 )
 from fastapi.responses import JSONResponse
 
-from verifier import verify_video
+from http_client import create_http_client
+from result_cache import VerificationCache
+from verifier import (
+    FAST_MODE,
+    FULL_MODE,
+    VideoOpenError,
+    VideoTruncatedError,
+    verify_video,
+)
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -21,40 +33,179 @@ logger = logging.getLogger()
 
 base_url = 'https://ipfs.objective.camera/{}'
 
+# Shared with the web service which stores uploaded videos named by their hash
+VIDEOS_DIR = os.getenv('VIDEOS_DIR', '/videos')
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Remote videos are decoded straight from the gateway URL instead of being downloaded first
+VERIFIER_STREAM_REMOTE = os.getenv('VERIFIER_STREAM_REMOTE', '1') == '1'
+# Stop reading the video once the verdict can't change, reported times are then lower bounds
+VERIFIER_STOP_WHEN_DECIDED = os.getenv('VERIFIER_STOP_WHEN_DECIDED', '1') == '1'
+
+# Mode used when /verify is called without one, see compare_modes.py to tune the fast one
+VERIFIER_MODE = os.getenv('VERIFIER_MODE', 'full')
+VERIFICATION_MODES = {
+    'full': FULL_MODE,
+    'fast': dict(
+        frame_stride=int(os.getenv('VERIFIER_FAST_FRAME_STRIDE', FAST_MODE['frame_stride'])),
+        scale=float(os.getenv('VERIFIER_FAST_SCALE', FAST_MODE['scale'])),
+        min_features=int(os.getenv('VERIFIER_FAST_MIN_FEATURES', FAST_MODE['min_features'])),
+    ),
+}
+
+# verify_video is CPU bound, it runs in worker processes to keep the event loop free
+VERIFIER_WORKERS = int(os.getenv('VERIFIER_WORKERS', os.cpu_count() or 1))
+
+# Client of the IPFS gateway kept for the app lifetime, limits and retries are set in http_client.py
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 60))
+# Serves the API on this Unix socket instead of TCP, e.g. for the web service on the same host
+VERIFIER_UDS = os.getenv('VERIFIER_UDS') or None
+
 app = FastAPI()
+executor = None
+http_client = None
+
+
+async def download_video(url: str, path: str):
+    """Streams the video to `path` chunk by chunk, memory use doesn't depend on its size."""
+    async with http_client.stream('GET', url) as resp:
+        resp.raise_for_status()
+        async with aiofiles.open(path, 'wb') as out_file:
+            async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                await out_file.write(chunk)
+
+
+@asynccontextmanager
+async def downloaded_video(cid: str):
+    """Yields a path of the video downloaded to a temp file which is removed afterwards."""
+    tmp_path = f'/tmp/{cid}-{uuid.uuid4().hex}.mp4'
+    try:
+        print(f'Downloading video {cid}...')
+        await download_video(base_url.format(cid), tmp_path)
+        print(f'Stored video in temp file {tmp_path}.')
+        yield tmp_path
+    finally:
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+
+
+async def run_verification(
+        video_path: str,
+        direction: int,
+        second_direction: int,
+        mode: str,
+        check_complete: bool = False,
+):
+    print(f'Start verification {video_path}.')
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        partial(
+            verify_video,
+            video_path,
+            direction,
+            second_direction,
+            stop_when_decided=VERIFIER_STOP_WHEN_DECIDED,
+            check_complete=check_complete,
+            **VERIFICATION_MODES[mode],
+        ),
+    )
+
+
+async def verify_cid(cid: str, direction: int, second_direction: int, mode: str):
+    """Verifies the video from the shared volume, or from the gateway if it wasn't uploaded to this host.
+
+    Remote videos are decoded while they are being downloaded, if the decoder can't
+    open the URL or the stream ends early the video is downloaded to disk first,
+    so a dropped stream never gives a cached negative verdict.
+    """
+    local_path = os.path.join(VIDEOS_DIR, cid)
+    if await aiofiles.os.path.isfile(local_path):
+        return await run_verification(local_path, direction, second_direction, mode)
 
+    if VERIFIER_STREAM_REMOTE:
+        try:
+            return await run_verification(
+                base_url.format(cid), direction, second_direction, mode, check_complete=True,
+            )
+        except (VideoOpenError, VideoTruncatedError) as e:
+            logger.info(f'Could not stream video {cid}, downloading it: {e!r}')
 
-async def get_original_video(url):
-    async with httpx.AsyncClient(timeout=60) as client:
-        return await client.get(url)
+    async with downloaded_video(cid) as video_path:
+        return await run_verification(video_path, direction, second_direction, mode)
 
 
-cache = {}
+cache = None
 
 @app.get('/verify/{cid}/{direction}/{second_direction}')
-async def verify(cid: str, direction: int, second_direction: int):
-    content = cache.get(cid)
+async def verify(cid: str, direction: int, second_direction: int, mode: str = None):
+    mode = mode or VERIFIER_MODE
+    if mode not in VERIFICATION_MODES:
+        return JSONResponse(
+            status_code=400,
+            content={'code': 'unknown_mode', 'msg': f'mode must be one of {", ".join(VERIFICATION_MODES)}'},
+        )
+    cache_key = (cid, direction, second_direction, mode)
+    content = await cache.get(cache_key)
     if not content:
-        print(f'Downloading video {cid}...')
-        resp = await get_original_video(base_url.format(cid))
-        print(f'Downloaded video {cid}.')
-        original_file_path = f'/tmp/{cid}.mp4'
-        async with aiofiles.open(original_file_path, 'wb') as out_file:
-            await out_file.write(resp.content)
-        print(f'Stored video in temp file {original_file_path}.')
-        print(f'Start verification {original_file_path}.')
-        is_verified, direction_time, second_direction_time, rotateCode = verify_video(original_file_path, direction, second_direction)
-        await aiofiles.os.remove(original_file_path)
+        is_verified, direction_time, second_direction_time, rotateCode = await verify_cid(
+            cid, direction, second_direction, mode,
+        )
         content = {
             'is_verified': is_verified,
             'direction_time': direction_time,
             'second_direction_time': second_direction_time,
             'rotate_code': rotateCode,
         }
-        cache[cid] = content
+        await cache.set(cache_key, content)
 
     return JSONResponse(status_code=200, content=content)
 
 
+@app.get('/stats/cache')
+async def cache_stats():
+    return JSONResponse(status_code=200, content=await cache.stats())
+
+
+@app.get('/health')
+async def health():
+    return JSONResponse(status_code=200, content={'workers': VERIFIER_WORKERS})
+
+
+@app.on_event("startup")
+def open_cache():
+    global cache
+    cache = VerificationCache()
+
+
+@app.on_event("startup")
+def start_workers():
+    global executor
+    # OpenCV isn't fork safe once its threads are started, so workers are spawned
+    executor = ProcessPoolExecutor(
+        max_workers=VERIFIER_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+
+@app.on_event("startup")
+def open_http_client():
+    global http_client
+    http_client = create_http_client(timeout=HTTP_TIMEOUT)
+
+
+@app.on_event("shutdown")
+def stop_workers():
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    if VERIFIER_UDS:
+        uvicorn.run(app, uds=VERIFIER_UDS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8002)
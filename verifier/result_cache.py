@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+VERIFICATION_CACHE_PATH = os.getenv('VERIFICATION_CACHE_PATH', '/cache/verification.sqlite3')
+VERIFICATION_CACHE_MEMORY_SIZE = int(os.getenv('VERIFICATION_CACHE_MEMORY_SIZE', 1000))
+VERIFICATION_CACHE_DISK_SIZE = int(os.getenv('VERIFICATION_CACHE_DISK_SIZE', 1000000))
+# The disk tier is trimmed back to its size once per this many inserts, it may exceed the size by as much
+VERIFICATION_CACHE_TRIM_INTERVAL = int(os.getenv('VERIFICATION_CACHE_TRIM_INTERVAL', 1000))
+
+# Stored in PRAGMA user_version, bumped with every change of the table
+SCHEMA_VERSION = 1
+
+# (cid, direction, second_direction, mode)
+CacheKey = Tuple[str, int, int, str]
+
+
+class VerificationCache:
+    """Verification results in a memory LRU backed by an SQLite file that survives restarts.
+
+    Both tiers are bounded, the disk one evicts least recently read results.
+    """
+
+    def __init__(
+            self,
+            path: str = VERIFICATION_CACHE_PATH,
+            memory_size: int = VERIFICATION_CACHE_MEMORY_SIZE,
+            disk_size: int = VERIFICATION_CACHE_DISK_SIZE,
+            trim_interval: int = VERIFICATION_CACHE_TRIM_INTERVAL,
+    ):
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.trim_interval = trim_interval
+        self._inserts_since_trim = 0
+        self.memory: 'OrderedDict[CacheKey, dict]' = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._init_db()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'verification'"
+            ).fetchone()
+            if exists and version < 1:
+                # results cached before modes existed were all verified in full mode,
+                # the primary key changes so the table is rebuilt
+                conn.execute('ALTER TABLE verification RENAME TO verification_v0')
+                conn.execute('DROP INDEX IF EXISTS verification_accessed_at_idx')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS verification (
+                    cid TEXT NOT NULL,
+                    direction INTEGER NOT NULL,
+                    second_direction INTEGER NOT NULL,
+                    mode TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (cid, direction, second_direction, mode)
+                )
+            ''')
+            if exists and version < 1:
+                conn.execute('''
+                    INSERT INTO verification
+                    SELECT cid, direction, second_direction, 'full', result, accessed_at FROM verification_v0
+                ''')
+                conn.execute('DROP TABLE verification_v0')
+            conn.execute('CREATE INDEX IF NOT EXISTS verification_accessed_at_idx ON verification (accessed_at)')
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._trim(conn)
+
+    def _trim(self, conn: sqlite3.Connection):
+        conn.execute('''
+            DELETE FROM verification WHERE rowid IN (
+                SELECT rowid FROM verification
+                ORDER BY accessed_at
+                LIMIT MAX((SELECT COUNT(*) FROM verification) - ?, 0)
+            )
+        ''', (self.disk_size,))
+        self._inserts_since_trim = 0
+
+    def _disk_get(self, key: CacheKey) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT result FROM verification WHERE cid = ? AND direction = ? AND second_direction = ? AND mode = ?',
+                key,
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                'UPDATE verification SET accessed_at = ? WHERE cid = ? AND direction = ? AND second_direction = ? AND mode = ?',
+                (time.time(),) + key,
+            )
+            return json.loads(row[0])
+
+    def _disk_set(self, key: CacheKey, result: dict):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO verification VALUES (?, ?, ?, ?, ?, ?)',
+                key + (json.dumps(result), time.time()),
+            )
+            # counting the rows on every insert scans the whole table
+            self._inserts_since_trim += 1
+            if self._inserts_since_trim >= self.trim_interval:
+                self._trim(conn)
+
+    def _disk_count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM verification').fetchone()[0]
+
+    def _memory_set(self, key: CacheKey, result: dict):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    async def get(self, key: CacheKey) -> Optional[dict]:
+        result = self.memory.get(key)
+        if result is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return result
+        result = await asyncio.to_thread(self._disk_get, key)
+        if result is not None:
+            self._memory_set(key, result)
+            self.disk_hits += 1
+            return result
+        self.misses += 1
+        return None
+
+    async def set(self, key: CacheKey, result: dict):
+        self._memory_set(key, result)
+        await asyncio.to_thread(self._disk_set, key, result)
+
+    async def stats(self) -> dict:
+        return {
+            'memory_size': len(self.memory),
+            'memory_max_size': self.memory_size,
+            'disk_size': await asyncio.to_thread(self._disk_count),
+            'disk_max_size': self.disk_size,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
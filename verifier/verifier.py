@@ -7,9 +7,28 @@ import ffmpeg
 
 import math
 
-def check_rotation(path_video_file):
+# verify_video verdict thresholds
+MIN_DIRECTION_TIME = 4000
+MIN_SECOND_DIRECTION_TIME = 100
+
+# Timestamps of the last frames may slightly exceed the container duration
+DURATION_SLACK_MS = 500
+# A decode ending earlier than this before the container duration is treated as truncated
+TRUNCATION_SLACK_MS = 1000
+
+
+class VideoOpenError(Exception):
+    pass
+
+
+class VideoTruncatedError(Exception):
+    """Decoding stopped well before the end of the video, e.g. a stream dropped midway."""
+
+
+def check_rotation(path_video_file, meta_dict=None):
     # this returns meta-data of the video file in form of a dictionary
-    meta_dict = ffmpeg.probe(path_video_file)
+    if meta_dict is None:
+        meta_dict = ffmpeg.probe(path_video_file)
 
     print(meta_dict)
 
@@ -51,6 +70,29 @@ def check_rotation(path_video_file):
         return cv2.ROTATE_90_COUNTERCLOCKWISE
 
 
+def video_duration_ms(meta_dict):
+    duration = meta_dict.get('format', {}).get('duration')
+    if duration is None:
+        return None
+    return float(duration) * 1000
+
+
+def is_decided(in_direction_time, in_second_direction_time, current_time, duration_ms):
+    """Whether the rest of the video can no longer change the verdict.
+
+    Both times only grow, by at most the remaining duration of the video.
+    """
+    if in_direction_time > MIN_DIRECTION_TIME and in_second_direction_time > MIN_SECOND_DIRECTION_TIME:
+        return True
+    if duration_ms is None:
+        return False
+    remaining = duration_ms - current_time + DURATION_SLACK_MS
+    return (
+        in_direction_time + remaining <= MIN_DIRECTION_TIME
+        or in_second_direction_time + remaining <= MIN_SECOND_DIRECTION_TIME
+    )
+
+
 def correct_rotation(frame, rotateCode):  
      return cv2.rotate(frame, rotateCode)
 
@@ -59,9 +101,57 @@ def angle_distance(target_angle, source_angle):
     return math.atan2(math.sin((target_angle-source_angle) / 180 * math.pi), math.cos((target_angle-source_angle) / 180  * math.pi)) * 180 / math.pi
 
 
-def verify_video(video_path, direction, second_direction, verbose=False):
+def average_motion(good_new, good_old):
+    """Returns average (x, y) camera movement in pixels between two frames.
+
+    good_new and good_old are (N, 2) float32 arrays of the same tracked points, N > 0.
+    Points move left when the camera turns right, hence the inverted x.
+    Gives the same results as summing the deltas point by point with NumPy 1.x,
+    pinned in requirements.txt: the float32 deltas are added one by one in float64,
+    as `0 + np.float32` is a float64 there. cumsum adds sequentially, sum and mean pairwise.
+    """
+    x_sum = np.cumsum(good_old[:, 0] - good_new[:, 0], dtype=np.float64)[-1]
+    y_sum = np.cumsum(good_new[:, 1] - good_old[:, 1], dtype=np.float64)[-1]
+    return x_sum / len(good_new), y_sum / len(good_new)
+
+
+# frame_stride: optical flow runs on every Nth frame only
+# scale: frames are downscaled by this factor before optical flow
+# min_features: features are re-detected once fewer points are tracked
+FULL_MODE = dict(frame_stride=1, scale=1.0, min_features=0)
+FAST_MODE = dict(frame_stride=2, scale=0.5, min_features=30)
+
+
+def to_gray(frame, scale):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if scale != 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def verify_video(
+        video_path,
+        direction,
+        second_direction,
+        verbose=False,
+        frame_stride=1,
+        scale=1.0,
+        min_features=0,
+        stop_when_decided=False,
+        check_complete=False,
+):
+    """Checks that the camera looked in `direction` and then turned to `second_direction`.
+
+    video_path may also be a URL, frames are then decoded while the video is being downloaded.
+    With stop_when_decided the video is only read until the verdict can't change anymore,
+    returned times are then lower bounds.
+    With check_complete VideoTruncatedError is raised when frames stop coming before
+    the container duration, instead of returning a verdict on part of the video.
+    """
     # Read the video 
     cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise VideoOpenError(video_path)
  
     # Parameters for ShiTomasi corner detection
     feature_params = dict(maxCorners=100, qualityLevel=0.3, minDistance=7, blockSize=7)
@@ -77,20 +167,25 @@ def verify_video(video_path, direction, second_direction, verbose=False):
     color = np.random.randint(0, 255, (100, 3))
  
     # check if video requires rotation
-    rotateCode = check_rotation(video_path)
+    meta_dict = ffmpeg.probe(video_path)
+    rotateCode = check_rotation(video_path, meta_dict)
+    duration_ms = video_duration_ms(meta_dict)
     # rotateCode = cv2.ROTATE_180
 
     # Take first frame and find corners in it
     ret, old_frame = cap.read()
-    old_gray = cv2.cvtColor(old_frame, cv2.COLOR_BGR2GRAY)
+    if not ret:
+        cap.release()
+        raise VideoTruncatedError(video_path)
+    old_gray = to_gray(old_frame, scale)
 
     if rotateCode is not None:
         old_gray = correct_rotation(old_gray, rotateCode)
 
     p0 = cv2.goodFeaturesToTrack(old_gray, mask=None, **feature_params)
 
-    width = old_frame.shape[1]
-    height = old_frame.shape[0]
+    width = old_frame.shape[1] * scale
+    height = old_frame.shape[0] * scale
     one_width_angle = 180 / 4
     one_height_angle = 180 / 5
 
@@ -105,22 +200,30 @@ def verify_video(video_path, direction, second_direction, verbose=False):
 
     prev_time = 0.0
     current_time = 0.0
+    last_frame_time = 0.0
+    reached_end = False
     in_direction = True
     in_second_direction = False
 
     while True:
-        # Read new frame
+        # Read new frame, skipped frames are only grabbed without being decoded into an image
+        for _ in range(frame_stride - 1):
+            if not cap.grab():
+                break
         ret, frame = cap.read()
 
-        if rotateCode is not None:
-            frame = correct_rotation(frame, rotateCode)
-
         prev_time = current_time
         current_time = cap.get(cv2.CAP_PROP_POS_MSEC)
         print('frame time: ', current_time)
         if not ret:
+            reached_end = True
             break
-        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        last_frame_time = current_time
+
+        if rotateCode is not None:
+            frame = correct_rotation(frame, rotateCode)
+
+        frame_gray = to_gray(frame, scale)
     
         # Calculate Optical Flow
         p1, st, err = cv2.calcOpticalFlowPyrLK(
@@ -134,28 +237,21 @@ def verify_video(video_path, direction, second_direction, verbose=False):
         good_new = p1[st == 1]
         good_old = p0[st == 1]
     
-        x_deltas = []
-        y_deltas = []
-
-        # Draw the tracks
-        for i, (new, old) in enumerate(zip(good_new, good_old)):
-            x1, y1 = new.ravel()
-            x2, y2 = old.ravel()
-            x_deltas.append(x2 - x1)
-            y_deltas.append(y1 - y2)
-
-            # only needed for visualization
-            if verbose:
+        # only needed for visualization
+        if verbose:
+            # Draw the tracks
+            for i, (new, old) in enumerate(zip(good_new, good_old)):
+                x1, y1 = new.ravel() / scale
+                x2, y2 = old.ravel() / scale
                 mask = cv2.line(mask, (int(x1), int(y1)), (int(x2), int(y2)), color[i].tolist(), 2)
                 frame = cv2.circle(frame, (int(x1), int(y1)), 5, color[i].tolist(), -1)
 
-        if(len(x_deltas) > 0):
-            avg_x_delta = sum(x_deltas) / len(x_deltas)
+        if(len(good_new) > 0):
+            avg_x_delta, avg_y_delta = average_motion(good_new, good_old)
             x_movement += avg_x_delta
             movement_x_angle = x_movement / width * one_width_angle
             # print('x_movement:', movement_x_angle)
 
-            avg_y_delta = sum(y_deltas) / len(y_deltas)
             y_movement += avg_y_delta
             movement_y_angle = y_movement / height * one_height_angle
             # print('y_movement:', movement_y_angle)
@@ -175,6 +271,9 @@ def verify_video(video_path, direction, second_direction, verbose=False):
                 in_second_direction_time += current_time - prev_time
 
         # print('in_direction_time: ', in_direction_time, 'in_second_direction_time: ', in_second_direction_time, )
+
+        if stop_when_decided and is_decided(in_direction_time, in_second_direction_time, current_time, duration_ms):
+            break
     
         # only needed for visualization
         if verbose:
@@ -189,8 +288,17 @@ def verify_video(video_path, direction, second_direction, verbose=False):
         # Update the previous frame and previous points
         old_gray = frame_gray.copy()
         p0 = good_new.reshape(-1, 1, 2)
-
-    return in_direction_time > 4000 and in_second_direction_time > 100, round(in_direction_time, 2), round(in_second_direction_time, 2), rotateCode
+        if len(good_new) < min_features:
+            features = cv2.goodFeaturesToTrack(frame_gray, mask=None, **feature_params)
+            if features is not None:
+                p0 = features
+
+    cap.release()
+    if check_complete and reached_end and duration_ms is not None \
+            and last_frame_time < duration_ms - TRUNCATION_SLACK_MS:
+        raise VideoTruncatedError(f'{video_path}: decoded {last_frame_time} ms of {duration_ms} ms')
+    is_verified = in_direction_time > MIN_DIRECTION_TIME and in_second_direction_time > MIN_SECOND_DIRECTION_TIME
+    return is_verified, round(in_direction_time, 2), round(in_second_direction_time, 2), rotateCode
 
 
 if __name__ == '__main__':
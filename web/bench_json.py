@@ -0,0 +1,86 @@
+"""Compares serialization of list endpoint responses: pydantic round-trip against FastJSONResponse.
+
+Rows are synthetic and shaped like VIDEO_REQUEST_COLUMNS, half of them fulfilled,
+so only serialization is measured, not the database.
+
+Usage: python bench_json.py [--rows 10000] [--repeat 5]
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse
+
+from models import VideoRequestManager
+from responses import FastJSONResponse
+
+
+def make_rows(count):
+    started_at = datetime(2022, 11, 1, 12, 30, 15, 123456)
+    rows = []
+    for i in range(count):
+        fulfilled = i % 2 == 0
+        rows.append((
+            str(i),
+            f'0x{i:064x}',
+            30_000_000 + i,
+            41.7 + i / 1e6,
+            44.8 - i / 1e6,
+            100,
+            started_at + timedelta(minutes=i),
+            started_at + timedelta(minutes=i + 30),
+            i % 360,
+            (i + 90) % 360,
+            Decimal('1000000000000000') + i,
+            '0x7DB4C793cECE6f1e586B8bc82ad5E6C0355AbB7E',
+            '0x7DB4C793cECE6f1e586B8bc82ad5E6C0355AbB7E' if fulfilled else None,
+            41.7 if fulfilled else None,
+            44.8 if fulfilled else None,
+            i % 360 if fulfilled else None,
+            started_at + timedelta(minutes=i + 10) if fulfilled else None,
+            started_at + timedelta(minutes=i + 1) if fulfilled else None,
+            started_at + timedelta(minutes=i + 2) if fulfilled else None,
+            f'{i:064x}' if fulfilled else None,
+        ))
+    return rows
+
+
+def pydantic_path(rows) -> bytes:
+    requests = [VideoRequestManager.to_video_request(row) for row in rows]
+    return JSONResponse(content={'requests': [json.loads(r.json()) for r in requests]}).body
+
+
+def fast_path(rows) -> bytes:
+    requests = [VideoRequestManager.to_video_request_dict(row) for row in rows]
+    return FastJSONResponse(content={'requests': requests}).body
+
+
+def best_of(func, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func(rows)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares serialization of list endpoint responses.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    assert json.loads(pydantic_path(rows)) == json.loads(fast_path(rows)), 'the paths render different JSON'
+
+    pydantic_seconds = best_of(pydantic_path, rows, args.repeat)
+    fast_seconds = best_of(fast_path, rows, args.repeat)
+    print(f'{args.rows} rows, best of {args.repeat}')
+    print(f'pydantic round-trip: {pydantic_seconds * 1000:.1f} ms')
+    print(f'FastJSONResponse:    {fast_seconds * 1000:.1f} ms ({pydantic_seconds / fast_seconds:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
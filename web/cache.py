@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import sys
+from typing import Callable, List, Optional, Tuple
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+from models import (
+    DEFAULT_PAGE_SIZE,
+    VideoRequest,
+    VideoRequestManager,
+)
+from ttl_cache import LRUCache, MISSING
+
+REQUEST_CACHE_MAX_SIZE = int(os.getenv('REQUEST_CACHE_MAX_SIZE', 10000))
+REQUEST_CACHE_TTL = float(os.getenv('REQUEST_CACHE_TTL', 60))
+CACHE_LISTENER_RECONNECT_INTERVAL = 5
+
+# Must match the channel used by the trigger in migrations/0003_notify_video_request_changed.sql
+VIDEO_REQUEST_CHANGED_CHANNEL = 'video_request_changed'
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+class CachedVideoRequestManager(VideoRequestManager):
+    """Serves get_request and the first page of get_requests from memory.
+
+    Rows change only on insert and fulfilment, both of which NOTIFY
+    VIDEO_REQUEST_CHANGED_CHANNEL, see `listen_for_invalidations`.
+    """
+
+    def __init__(self, pool: AsyncConnectionPool):
+        super().__init__(pool)
+        self.requests_cache = LRUCache(REQUEST_CACHE_MAX_SIZE, REQUEST_CACHE_TTL)
+        # keyed by page size, only pages without a cursor are cached
+        self.latest_cache = LRUCache(REQUEST_CACHE_MAX_SIZE, REQUEST_CACHE_TTL)
+
+    async def get_request(self, request_id: str) -> VideoRequest:
+        request = self.requests_cache.get(request_id)
+        if request is MISSING:
+            generation = self.requests_cache.generation
+            request = await super().get_request(request_id)
+            self.requests_cache.set(request_id, request, generation)
+        return request
+
+    async def get_requests(
+            self,
+            limit: int = DEFAULT_PAGE_SIZE,
+            cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        if cursor:
+            return await super().get_requests(limit, cursor)
+        page = self.latest_cache.get(limit)
+        if page is MISSING:
+            generation = self.latest_cache.generation
+            page = await super().get_requests(limit)
+            self.latest_cache.set(limit, page, generation)
+        return page
+
+    def invalidate(self, request_id: str):
+        self.requests_cache.invalidate(request_id)
+        # any new or fulfilled request may show up on the latest pages
+        self.latest_cache.clear()
+
+    def clear(self):
+        self.requests_cache.clear()
+        self.latest_cache.clear()
+
+    def cache_stats(self) -> dict:
+        return {
+            'requests': self.requests_cache.stats(),
+            'latest': self.latest_cache.stats(),
+        }
+
+
+async def listen_for_invalidations(
+        pg_conn_str: str,
+        manager: CachedVideoRequestManager,
+        on_change: Callable[[str], None] = None,
+):
+    """Keeps the cache of this worker coherent with writes made by any worker.
+
+    `on_change` is called with the id of every inserted or updated request.
+    """
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(pg_conn_str, autocommit=True) as conn:
+                await conn.execute(f'LISTEN {VIDEO_REQUEST_CHANGED_CHANNEL}')
+                # notifications sent while we weren't listening are lost
+                manager.clear()
+                logger.info(f'Listening to {VIDEO_REQUEST_CHANGED_CHANNEL} for cache invalidation')
+                async for notify in conn.notifies():
+                    manager.invalidate(notify.payload)
+                    if on_change:
+                        on_change(notify.payload)
+        except Exception as e:
+            logger.exception(e)
+        manager.clear()
+        await asyncio.sleep(CACHE_LISTENER_RECONNECT_INTERVAL)
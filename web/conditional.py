@@ -0,0 +1,20 @@
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison
+    return etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))
+
+
+def not_modified_since(if_modified_since: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # Last-Modified has a second resolution
+    return int(mtime) <= since.timestamp()
@@ -4,8 +4,9 @@ import json
 import logging
 import os
 import sys
-import psycopg
+from functools import lru_cache
 
+from eth_utils import event_abi_to_log_topic
 from web3 import Web3
 
 from models import (
@@ -13,11 +14,20 @@ from models import (
     VideoRequest,
     Location,
 )
+from rpc import JSONRPCClient, RPCError, format_log
 
 WEB3_HTTP_PROVIDER_URL = os.getenv('WEB3_HTTP_PROVIDER_URL')
 
 VIDEO_REQUESTER_CONTRACT_ADDR = '0xC6ea1442139Fd2938098E638213302b05DDD6CC6'
 VIDEO_REQUESTS_PULL_INTERVAL = 5
+# Block to start from when there is no checkpoint yet
+VIDEO_REQUESTER_DEPLOY_BLOCK = int(os.getenv('VIDEO_REQUESTER_DEPLOY_BLOCK', 1))
+VIDEO_REQUESTED_CHECKPOINT = 'video_requested'
+# Initial and max number of blocks per eth_getLogs call
+LOGS_CHUNK_SIZE = int(os.getenv('LOGS_CHUNK_SIZE', 2000))
+LOGS_MAX_CHUNK_SIZE = int(os.getenv('LOGS_MAX_CHUNK_SIZE', 10000))
+# Number of eth_getLogs ranges sent in one batch while catching up
+LOGS_RANGES_PER_BATCH = int(os.getenv('LOGS_RANGES_PER_BATCH', 4))
 
 CONTRACT_CALLER_ADDR = os.getenv('CONTRACT_CALLER_ADDR')
 CONTRACT_CALLER_PRIVATE_KEY = os.getenv('CONTRACT_CALLER_PRIVATE_KEY')
@@ -26,73 +36,109 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger()
 
 
-def w3_instance():
-    return Web3(Web3.HTTPProvider(WEB3_HTTP_PROVIDER_URL))
-
-
-def contract_instance(w3: Web3):
+@lru_cache(maxsize=None)
+def contract_instance():
+    """Contract used to encode calls and decode events, requests are sent with JSONRPCClient."""
     logger.info('Loading VideoRequester contract')
-    # WebsocketProvider doesn't work with the following error:
-    # TypeError: As of 3.10, the *loop* parameter was removed from Lock() since it is no longer necessary
     # It is possible to get contract ABI from the blockchain instead
     with open('VideoRequester.json') as f:
         contract_abi = json.load(f)
-    return w3.eth.contract(address=VIDEO_REQUESTER_CONTRACT_ADDR, abi=contract_abi)
-
-
-async def pull_video_requests(video_request_manager: VideoRequestManager):
-    contract = contract_instance(w3_instance())
-    # We start pulling from the next block after the highest one to avoid duplicates
-    from_block = (await video_request_manager.max_request_block_number())[0] or 0
-    from_block += 1
+    return Web3().eth.contract(address=VIDEO_REQUESTER_CONTRACT_ADDR, abi=contract_abi)
+
+
+def video_requested_topic() -> str:
+    contract_abi = contract_instance().abi
+    event_abi = next(item for item in contract_abi if item.get('type') == 'event' and item['name'] == 'VideoRequested')
+    return Web3.toHex(event_abi_to_log_topic(event_abi))
+
+
+def video_request_from_event(event) -> VideoRequest:
+    second_direction = (event.args.direction + (90 + random.randint(0, 180))) % 360
+    return VideoRequest(
+        id=str(event.args.requestId),
+        tx_hash=event.transactionHash.hex(),
+        block_number=event.blockNumber,
+        location=Location(
+            lat=event.args.lat / 10000000 - 180,
+            long=event.args.long / 10000000 - 180,
+            direction=event.args.direction,
+            radius=0,
+        ),
+        second_direction=second_direction,
+        start_time=event.args.start,
+        end_time=event.args.end,
+        reward=event.args.reward,
+        address=event.args.requester,
+    )
+
+
+async def pull_video_requests(video_request_manager: VideoRequestManager, rpc: JSONRPCClient):
+    """Ingests VideoRequested events in block ranges, each batch of ranges is stored with its checkpoint.
+
+    Each round-trip asks for the head block together with the next eth_getLogs ranges.
+    The range size adapts: it's halved when the provider rejects a range (too many
+    blocks or results) and grows back while ranges succeed.
+    """
+    event = contract_instance().events.VideoRequested()
+    topic = video_requested_topic()
+    last_block = await video_request_manager.get_checkpoint(VIDEO_REQUESTED_CHECKPOINT)
+    from_block = VIDEO_REQUESTER_DEPLOY_BLOCK if last_block is None else last_block + 1
+    latest_block = None
+    chunk_size = LOGS_CHUNK_SIZE
     while True:
-        logger.info(f'Pulling VideoRequested events from block {from_block}')
-
         try:
-            event_filter = contract.events.VideoRequested.createFilter(fromBlock=from_block)
-            for event in event_filter.get_all_entries():
-                logger.info(f'Retrieved VideoRequested event: {event}')
-                second_direction = (event.args.direction + (90 + random.randint(0, 180))) % 360
-
-                event_id = event.transactionHash.hex()
-                video_request = VideoRequest(
-                    id=str(event.args.requestId),
-                    tx_hash=event_id,
-                    block_number=event.blockNumber,
-                    location=Location(
-                        lat=event.args.lat / 10000000 - 180,
-                        long=event.args.long / 10000000 - 180,
-                        direction=event.args.direction,
-                        radius=0,
-                    ),
-                    second_direction=second_direction,
-                    start_time=event.args.start,
-                    end_time=event.args.end,
-                    reward=event.args.reward,
-                    address=event.args.requester,
+            ranges = []
+            start = from_block
+            while latest_block is not None and start <= latest_block and len(ranges) < LOGS_RANGES_PER_BATCH:
+                end = min(start + chunk_size - 1, latest_block)
+                ranges.append((start, end))
+                start = end + 1
+            if ranges:
+                logger.info(f'Pulling VideoRequested events from blocks {ranges[0][0]}-{ranges[-1][1]}')
+            results = await rpc.batch([('eth_blockNumber', [])] + [
+                ('eth_getLogs', [{
+                    'address': VIDEO_REQUESTER_CONTRACT_ADDR,
+                    'topics': [topic],
+                    'fromBlock': hex(start),
+                    'toBlock': hex(end),
+                }])
+                for start, end in ranges
+            ])
+            if isinstance(results[0], RPCError):
+                raise results[0]
+            latest_block = int(results[0], 16)
+
+            video_requests = []
+            stored_to = None
+            for (start, end), logs in zip(ranges, results[1:]):
+                if isinstance(logs, RPCError):
+                    if chunk_size == 1:
+                        raise logs
+                    chunk_size = max((end - start + 1) // 2, 1)
+                    logger.info(f'eth_getLogs failed for {end - start + 1} blocks, retrying with {chunk_size}: {logs}')
+                    # the following ranges are retried too, the checkpoint can't skip this one
+                    break
+                video_requests.extend(
+                    video_request_from_event(event.processLog(format_log(log)))
+                    for log in logs
+                    if not log.get('removed')
                 )
-                try:
-                    await video_request_manager.add_request(video_request)
-                except psycopg.errors.UniqueViolation:
-                    logger.info(f'Ignoring duplicate VideoRequested event {event_id}')
-
-                from_block = max(event.blockNumber + 1, from_block)
+                stored_to = end
+            else:
+                if ranges:
+                    chunk_size = min(chunk_size * 2, LOGS_MAX_CHUNK_SIZE)
+
+            if stored_to is not None:
+                await video_request_manager.add_requests(
+                    video_requests,
+                    checkpoint=VIDEO_REQUESTED_CHECKPOINT,
+                    last_block=stored_to,
+                )
+                logger.info(f'Stored {len(video_requests)} VideoRequested events up to block {stored_to}')
+                from_block = stored_to + 1
+            if from_block <= latest_block:
+                continue
         except Exception as e:
             logger.exception(e)
 
         await asyncio.sleep(VIDEO_REQUESTS_PULL_INTERVAL)
-
-
-def call_check_request(request_id: str):
-    w3 = w3_instance()
-    nonce = w3.eth.get_transaction_count(CONTRACT_CALLER_ADDR)
-    contract = contract_instance(w3)
-
-    # Doesn't seem like a good idea to store the private key on the backend.
-    # It's a quick and dirty implementation for PoC.
-    # For production we must rethink the flow so that the backend doesn't transact any funds.
-    tx = contract.functions.checkRequest(int(request_id)).build_transaction({'nonce': nonce})
-    signed_tx = w3.eth.account.sign_transaction(tx, private_key=CONTRACT_CALLER_PRIVATE_KEY)
-    tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-
-    logger.info(f'Attempted to call checkRequest of contract {VIDEO_REQUESTER_CONTRACT_ADDR} for request {request_id}: {tx_hash}')
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import os
+import sys
+
+from psycopg_pool import AsyncConnectionPool
+
+PG_POOL_MIN_SIZE = int(os.getenv('PG_POOL_MIN_SIZE', 2))
+PG_POOL_MAX_SIZE = int(os.getenv('PG_POOL_MAX_SIZE', 10))
+# How long a handler waits for a free connection before PoolTimeout is raised
+PG_POOL_TIMEOUT = float(os.getenv('PG_POOL_TIMEOUT', 10))
+PG_POOL_MAX_IDLE = float(os.getenv('PG_POOL_MAX_IDLE', 600))
+PG_POOL_MAX_LIFETIME = float(os.getenv('PG_POOL_MAX_LIFETIME', 3600))
+PG_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('PG_POOL_HEALTH_CHECK_INTERVAL', 30))
+# Number of executions of the same query on a connection after which psycopg
+# prepares it server side. Pooled connections live long enough to benefit.
+PG_PREPARE_THRESHOLD = int(os.getenv('PG_PREPARE_THRESHOLD', 5))
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+def create_pool(pg_conn_str: str) -> AsyncConnectionPool:
+    """Creates a closed pool, it must be opened with `open_pool` on app startup."""
+    return AsyncConnectionPool(
+        pg_conn_str,
+        open=False,
+        name='web',
+        min_size=PG_POOL_MIN_SIZE,
+        max_size=PG_POOL_MAX_SIZE,
+        timeout=PG_POOL_TIMEOUT,
+        max_idle=PG_POOL_MAX_IDLE,
+        max_lifetime=PG_POOL_MAX_LIFETIME,
+        kwargs={'prepare_threshold': PG_PREPARE_THRESHOLD},
+    )
+
+
+async def open_pool(pool: AsyncConnectionPool):
+    await pool.open(wait=True, timeout=PG_POOL_TIMEOUT)
+    logger.info(f'Opened Postgres pool {pool.name}: {pool.get_stats()}')
+
+
+async def close_pool(pool: AsyncConnectionPool):
+    await pool.close()
+    logger.info(f'Closed Postgres pool {pool.name}')
+
+
+async def check_pool_health(pool: AsyncConnectionPool):
+    """Periodically checks idle connections and replaces the broken ones."""
+    while True:
+        await asyncio.sleep(PG_POOL_HEALTH_CHECK_INTERVAL)
+        try:
+            await pool.check()
+        except Exception as e:
+            logger.exception(e)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import math
+import os
+import sys
+from typing import AsyncIterator, List, Set
+
+import orjson
+
+from models import VideoRequestManager
+from responses import json_default
+
+# Events buffered per subscriber, a subscriber which falls further behind is disconnected
+FEED_QUEUE_SIZE = int(os.getenv('FEED_QUEUE_SIZE', 100))
+FEED_MAX_SUBSCRIBERS = int(os.getenv('FEED_MAX_SUBSCRIBERS', 1000))
+# Changes are collected for this many seconds and loaded with one query
+FEED_FLUSH_INTERVAL = float(os.getenv('FEED_FLUSH_INTERVAL', 0.5))
+# Keeps proxies from closing idle streams
+FEED_HEARTBEAT_INTERVAL = float(os.getenv('FEED_HEARTBEAT_INTERVAL', 15))
+
+EARTH_RADIUS_METERS = 6_371_008.8
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+def distance_meters(lat1: float, long1: float, lat2: float, long2: float) -> float:
+    """Great-circle distance, close enough to ST_DWithin on the sphere."""
+    lat1, long1, lat2, long2 = map(math.radians, (lat1, long1, lat2, long2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def sse_event(event: str, data) -> bytes:
+    return b'event: ' + event.encode() + b'\ndata: ' + orjson.dumps(data, default=json_default) + b'\n\n'
+
+
+class FeedFull(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, lat: float, long: float, radius: int):
+        self.lat = lat
+        self.long = long
+        self.radius = radius
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=FEED_QUEUE_SIZE)
+        self.lagged = False
+
+    def matches(self, request: dict) -> bool:
+        location = request['location']
+        return distance_meters(self.lat, self.long, location['lat'], location['long']) <= self.radius
+
+    def push(self, event: bytes):
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a slow client never holds back the others, it has to catch up by polling
+            self.lagged = True
+
+
+class RequestFeed:
+    """Pushes new and fulfilled requests to subscribers of an area.
+
+    Every insert and update of video_request is NOTIFYed to all web workers,
+    so subscribers get changes made by the ingestion loop and uploads of any worker.
+    """
+
+    def __init__(self, manager: VideoRequestManager):
+        self.manager = manager
+        self.subscriptions: Set[Subscription] = set()
+        self._changed: Set[str] = set()
+        self._wake = asyncio.Event()
+
+    def changed(self, request_id: str):
+        if self.subscriptions:
+            self._changed.add(request_id)
+            self._wake.set()
+
+    def publish(self, requests: List[dict]):
+        for request in requests:
+            event = None
+            for subscription in self.subscriptions:
+                if subscription.matches(request):
+                    # serialized once for all subscribers
+                    event = event or sse_event('fulfilled' if request['video'] else 'requested', request)
+                    subscription.push(event)
+
+    async def run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            request_ids, self._changed = list(self._changed), set()
+            try:
+                self.publish(await self.manager.get_requests_by_ids(request_ids))
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(FEED_FLUSH_INTERVAL)
+
+    def subscribe(self, lat: float, long: float, radius: int) -> Subscription:
+        if len(self.subscriptions) >= FEED_MAX_SUBSCRIBERS:
+            raise FeedFull
+        subscription = Subscription(lat, long, radius)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    async def stream(self, subscription: Subscription, is_disconnected) -> AsyncIterator[bytes]:
+        """Yields server-sent events until the client disconnects or lags behind."""
+        try:
+            while not await is_disconnected():
+                try:
+                    yield await asyncio.wait_for(subscription.queue.get(), FEED_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b': heartbeat\n\n'
+                if subscription.lagged and subscription.queue.empty():
+                    yield sse_event('lagged', {'msg': 'too many events were missed, poll to catch up'})
+                    return
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,32 @@
+import os
+
+import httpx
+
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+# Retries of failed connection attempts, a request which reached the server isn't retried
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 2))
+
+
+def create_http_client(timeout: float = HTTP_TIMEOUT, uds: str = None) -> httpx.AsyncClient:
+    """Client meant to live as long as the app, so connections are kept alive between requests.
+
+    Services open it in a startup hook and close it in a shutdown hook.
+    The verifier and thumbnailer images copy this module, see their Dockerfiles.
+    `uds` sends requests over a Unix socket instead of TCP, the URL host is ignored then.
+    """
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+        transport=httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            retries=HTTP_RETRIES,
+            uds=uds,
+        ),
+    )
@@ -12,8 +12,10 @@ logger = logging.getLogger()
 
 
 class IPFSClient:
-    def __init__(self, base_url):
+    def __init__(self, base_url, client: httpx.AsyncClient):
+        """`client` is shared and closed by the app, see http_client.create_http_client."""
         self.base_url = base_url
+        self.client = client
 
     async def add(
         self,
@@ -22,26 +24,23 @@ class IPFSClient:
         files = {
             'file': (file.filename, file.file)
         }
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(f'{self.base_url}/api/v0/add', files=files)
-            logger.info(f'resp[add] {resp.text}')
-            return resp.text
+        resp = await self.client.post(f'{self.base_url}/api/v0/add', files=files)
+        logger.info(f'resp[add] {resp.text}')
+        return resp.text
 
     async def pin(
         self,
         file_hash: str,
     ) -> str:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(f'{self.base_url}/api/v0/pin/add?arg={file_hash}')
-            logger.info(f'resp[pin] {resp.text}')
-            return resp.text
+        resp = await self.client.post(f'{self.base_url}/api/v0/pin/add?arg={file_hash}')
+        logger.info(f'resp[pin] {resp.text}')
+        return resp.text
 
     async def file_exists(
         self,
         file_hash: str,
     ) -> bool:
         """Checks if file exist locally."""
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(f'{self.base_url}/api/v0/block/stat?arg={file_hash}&offline=true')
-            logger.info(f'resp[stat] {resp.text}')
-            return resp.status_code == 200
+        resp = await self.client.post(f'{self.base_url}/api/v0/block/stat?arg={file_hash}&offline=true')
+        logger.info(f'resp[stat] {resp.text}')
+        return resp.status_code == 200
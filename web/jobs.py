@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional
+
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+from pydantic import BaseModel
+
+from models import Video
+
+# Number of jobs processed at once by each web worker, 0 leaves the queue to other hosts
+UPLOAD_JOB_CONCURRENCY = int(os.getenv('UPLOAD_JOB_CONCURRENCY', 4))
+UPLOAD_JOB_POLL_INTERVAL = float(os.getenv('UPLOAD_JOB_POLL_INTERVAL', 1))
+# A running job isn't claimed by another worker for this many seconds
+UPLOAD_JOB_VISIBILITY_TIMEOUT = float(os.getenv('UPLOAD_JOB_VISIBILITY_TIMEOUT', 300))
+UPLOAD_JOB_MAX_ATTEMPTS = int(os.getenv('UPLOAD_JOB_MAX_ATTEMPTS', 5))
+# Delay before the first retry, doubled with every attempt
+UPLOAD_JOB_RETRY_DELAY = float(os.getenv('UPLOAD_JOB_RETRY_DELAY', 5))
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+class UploadJob(BaseModel):
+    id: int
+    request_id: str
+    video: Video
+    status: str
+    attempts: int
+    result: Any = None
+    last_error: str = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class JobRejected(Exception):
+    """The upload can't succeed, the job isn't retried."""
+
+    def __init__(self, result: dict):
+        super().__init__(result)
+        self.result = result
+
+
+UPLOAD_JOB_COLUMNS = 'id, request_id, video, status, attempts, result, last_error, created_at, updated_at'
+
+
+class UploadJobQueue:
+    """Upload jobs stored in the upload_job table, any number of workers on any host can consume it."""
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
+        self._wake = asyncio.Event()
+
+    def to_upload_job(self, row) -> UploadJob:
+        return UploadJob(
+            id=row[0],
+            request_id=row[1],
+            video=Video.parse_obj(row[2]),
+            status=row[3],
+            attempts=row[4],
+            result=row[5],
+            last_error=row[6],
+            created_at=row[7],
+            updated_at=row[8],
+        )
+
+    def wake(self):
+        """Makes the workers of this process look at the queue right away."""
+        self._wake.set()
+
+    async def wait(self):
+        try:
+            await asyncio.wait_for(self._wake.wait(), UPLOAD_JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def enqueue(self, request_id: str, video: Video) -> int:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute('''
+                INSERT INTO upload_job (request_id, video)
+                VALUES (%s, %s)
+                RETURNING id
+            ''', (request_id, Jsonb(json.loads(video.json())))
+            )
+            job_id = (await cur.fetchone())[0]
+        self.wake()
+        return job_id
+
+    async def get(self, job_id: int) -> Optional[UploadJob]:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(f'''
+                SELECT {UPLOAD_JOB_COLUMNS}
+                FROM upload_job
+                WHERE id = %s
+            ''', (job_id,)
+            )
+            row = await cur.fetchone()
+            return self.to_upload_job(row) if row else None
+
+    async def claim(self) -> Optional[UploadJob]:
+        """Takes the oldest runnable job, jobs locked by other workers are skipped instead of waited for."""
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(f'''
+                UPDATE upload_job
+                SET status = 'running',
+                    attempts = attempts + 1,
+                    locked_until = now() + make_interval(secs => %s),
+                    updated_at = now()
+                WHERE id = (
+                    SELECT id
+                    FROM upload_job
+                    WHERE status IN ('queued', 'running')
+                      AND (
+                          (status = 'queued' AND run_after <= now())
+                          OR (status = 'running' AND locked_until < now())
+                      )
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {UPLOAD_JOB_COLUMNS}
+            ''', (UPLOAD_JOB_VISIBILITY_TIMEOUT,)
+            )
+            row = await cur.fetchone()
+            return self.to_upload_job(row) if row else None
+
+    async def finish(self, job: UploadJob, status: str, result: dict):
+        # attempts identifies the claim, a worker which outlived its visibility timeout changes nothing
+        async with self.pool.connection() as conn:
+            await conn.execute('''
+                UPDATE upload_job
+                SET status = %s, result = %s, locked_until = NULL, updated_at = now()
+                WHERE id = %s AND attempts = %s AND status = 'running'
+            ''', (status, Jsonb(result), job.id, job.attempts)
+            )
+
+    async def retry(self, job: UploadJob, error: str):
+        """Puts the job back with a backoff, it fails for good after UPLOAD_JOB_MAX_ATTEMPTS."""
+        delay = UPLOAD_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        async with self.pool.connection() as conn:
+            await conn.execute('''
+                UPDATE upload_job
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+                    last_error = %s,
+                    run_after = now() + make_interval(secs => %s),
+                    locked_until = NULL,
+                    updated_at = now()
+                WHERE id = %s AND attempts = %s AND status = 'running'
+            ''', (UPLOAD_JOB_MAX_ATTEMPTS, error, delay, job.id, job.attempts)
+            )
+
+
+async def run_upload_worker(queue: UploadJobQueue, process: Callable[[UploadJob], Awaitable[dict]]):
+    """Claims and processes jobs until cancelled.
+
+    `process` returns the result of a succeeded job and raises JobRejected for
+    an upload which can't succeed, any other exception is retried.
+    """
+    while True:
+        try:
+            job = await queue.claim()
+        except Exception as e:
+            logger.exception(e)
+            job = None
+        if job is None:
+            await queue.wait()
+            continue
+
+        try:
+            await process_upload_job(queue, job, process)
+        except Exception as e:
+            # the job is claimed again once its visibility timeout passes
+            logger.exception(e)
+
+
+async def process_upload_job(queue: UploadJobQueue, job: UploadJob, process: Callable[[UploadJob], Awaitable[dict]]):
+    if job.attempts > UPLOAD_JOB_MAX_ATTEMPTS:
+        # the worker running the last attempt died
+        await queue.finish(job, 'failed', {'code': 'too_many_attempts'})
+        return
+    logger.info(f'Processing upload job {job.id} for request {job.request_id}, attempt {job.attempts}')
+    try:
+        result = await process(job)
+    except JobRejected as e:
+        await queue.finish(job, 'rejected', e.result)
+    except Exception as e:
+        logger.exception(e)
+        await queue.retry(job, str(e))
+    else:
+        await queue.finish(job, 'succeeded', result)
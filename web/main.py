@@ -5,54 +5,137 @@ import logging
 import sys
 from datetime import datetime
 from decimal import Decimal
+from typing import List, Set
 import os
 import httpx
-import hashlib
 
 import uvicorn
 from fastapi import (
-    BackgroundTasks,
     FastAPI,
     Form,
+    Header,
+    Request,
     UploadFile,
     File,
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 
+from eth_abi import encode
+from cache import (
+    CachedVideoRequestManager,
+    listen_for_invalidations,
+)
+from conditional import etag_matches
 from contract import (
-    call_check_request,
+    WEB3_HTTP_PROVIDER_URL,
     pull_video_requests,
 )
-from eth_abi import encode
-from contract import pull_video_requests
+from db import (
+    check_pool_health,
+    close_pool,
+    create_pool,
+    open_pool,
+)
+from migrate import apply_migrations
 from models import (
-    VideoRequestManager,
+    DEFAULT_PAGE_SIZE,
+    MAP_MAX_ZOOM,
+    InvalidCursor,
     Video,
     VideoRequest,
     Location,
     RequestNotFound,
+    SignedVideoHash,
+)
+from rpc import JSONRPCClient
+from feed import FeedFull, RequestFeed
+from http_client import create_http_client
+from jobs import (
+    UPLOAD_JOB_CONCURRENCY,
+    JobRejected,
+    UploadJob,
+    UploadJobQueue,
+    run_upload_worker,
+)
+from responses import (
+    FastJSONResponse,
+    not_modified_response,
+)
+from storage import (
+    store_upload,
+    video_path,
+)
+from submitter import (
+    ContractCallQueue,
+    TransactionSubmitter,
+    run_submitter,
+)
+from verification import (
+    SIGNATURE_BATCH_MAX_SIZE,
+    SignatureRecovery,
 )
-from verification import get_address
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger()
 
+VERIFIER_URL = os.getenv('VERIFIER_URL', 'http://localhost:8002')
+# Unix socket the verifier serves on, shared through the verifier_socket volume
+VERIFIER_UDS = os.getenv('VERIFIER_UDS') or None
+# Verification of a long video takes a while
+VERIFIER_TIMEOUT = float(os.getenv('VERIFIER_TIMEOUT', 300))
+THUMBNAILER_URL = os.getenv('THUMBNAILER_URL', 'http://localhost:8001')
+# Cache-Control max-age of /requests/{request_id} and /video/{request_id}, a fulfilled request never changes
+FULFILLED_REQUEST_MAX_AGE = int(os.getenv('FULFILLED_REQUEST_MAX_AGE', 365 * 24 * 3600))
+OPEN_REQUEST_MAX_AGE = int(os.getenv('OPEN_REQUEST_MAX_AGE', 10))
+
 app = FastAPI()
 pg_conn_str = f"host={os.getenv('PG_HOST', 'localhost')} dbname={os.getenv('PG_DB', 'obj')} user={os.getenv('PG_USER')} password={os.getenv('PG_PASSWORD')}"
+pool = create_pool(pg_conn_str)
+video_request_manager = CachedVideoRequestManager(pool=pool)
+contract_call_queue = ContractCallQueue(pool=pool)
+# shared by the ingestion loop and the submitter, so both reuse the same keep-alive connections
+rpc_client = JSONRPCClient(WEB3_HTTP_PROVIDER_URL)
+submitter = None
+signature_recovery = SignatureRecovery()
+upload_job_queue = UploadJobQueue(pool=pool)
+request_feed = RequestFeed(video_request_manager)
+http_client = None
+verifier_client = None
+# the event loop keeps only weak references to tasks, these are kept until they finish
+thumbnail_tasks: Set[asyncio.Task] = set()
 
 
 async def verify_request_video(cid, request):
-    url = f'http://localhost:8002/verify/{cid}/{request.location.direction}/{request.second_direction}'
+    url = f'{VERIFIER_URL}/verify/{cid}/{request.location.direction}/{request.second_direction}'
+    return await verifier_client.get(url)
+
+
+async def request_thumbnails(cid):
+    """Asks the thumbnailer to render thumbnails before anyone views the video."""
+    url = f'{THUMBNAILER_URL}/internal/thumbnails/{cid}'
+
+    try:
+        await http_client.post(url)
+    except httpx.HTTPError as e:
+        logger.exception(e)
+
+
+def log_task_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error('Background task failed', exc_info=task.exception())
 
-    async with httpx.AsyncClient() as client:
-        return await client.get(url)
+
+def schedule_thumbnails(cid):
+    task = asyncio.ensure_future(request_thumbnails(cid))
+    thumbnail_tasks.add(task)
+    task.add_done_callback(thumbnail_tasks.discard)
+    task.add_done_callback(log_task_error)
 
 
 @app.post('/upload/')
 async def upload(
-    background_tasks: BackgroundTasks,
     lat: float = Form(...),
     long: float = Form(...),
     start: float = Form(...),
@@ -65,7 +148,7 @@ async def upload(
     logger.info(f'New upload request: request_id: {request_id}, signature: {signature}')
 
     # check if file exists in /root/videos folder, name of file - expected_hash
-    file_exists = os.path.isfile(f'/videos/{expected_hash}')
+    file_exists = os.path.isfile(video_path(expected_hash))
 
     if file_exists:
         file_hash = expected_hash
@@ -78,28 +161,15 @@ async def upload(
             }
         )
 
-    uploader_address = get_address(expected_hash, signature)
+    uploader_address = await signature_recovery.get_address(expected_hash, signature)
 
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
     try:
-        request = await video_request_manager.get_request(
+        await video_request_manager.get_request(
             request_id=request_id,
         )
     except RequestNotFound:
         return JSONResponse(status_code=404)
 
-    try:
-        result = await verify_request_video(expected_hash, request)
-        if(not result.json()['is_verified']):
-            return JSONResponse(status_code=400, content={'is_verified': False})
-    except Exception as e:
-        logger.exception(e)
-        return JSONResponse(status_code=400, content={'is_verified': False})
-
-    # This is a very unreliable way to call a function of a smart contract.
-    # It's a quick and dirty implementation for PoC.
-    background_tasks.add_task(call_check_request, request_id)
-
     video = Video(
         uploader_address=uploader_address,
         location=Location(
@@ -113,32 +183,122 @@ async def upload(
         end_time=end,
         file_hash=file_hash,
     )
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
+    # verification may take a while, the client polls the job instead of holding the connection
+    job_id = await upload_job_queue.enqueue(request_id, video)
+    return JSONResponse(
+        status_code=202,
+        content={'job_id': job_id, 'status': 'queued'},
+    )
+
+
+async def process_upload(job: UploadJob) -> dict:
+    """Verifies an uploaded video and stores it, runs in the upload job workers."""
+    request = await video_request_manager.get_request(request_id=job.request_id)
+    video = job.video
+    if request.video is not None:
+        if request.video.file_hash == video.file_hash:
+            # a previous attempt stored the video but may have failed before the steps below
+            await finish_upload(job.request_id, request.video)
+            return json.loads(request.video.json())
+        raise JobRejected({
+            'code': 'request_already_fulfilled',
+            'msg': 'this request is already fulfilled',
+        })
+
+    result = await verify_request_video(video.file_hash, request)
+    result.raise_for_status()
+    if not result.json()['is_verified']:
+        raise JobRejected({'is_verified': False})
+
     await video_request_manager.add_video(
-        request_id=request_id,
+        request_id=job.request_id,
         video=video,
     )
+    await finish_upload(job.request_id, video)
+    return json.loads(video.json())
+
+
+async def finish_upload(request_id: str, video: Video):
+    """Steps after the video is stored, every one of them can be repeated by a retried job."""
+    # checkRequest is sent by the submitter, the upload doesn't wait for the blockchain
+    await contract_call_queue.enqueue(request_id)
+    if submitter:
+        submitter.wake()
+    schedule_thumbnails(video.file_hash)
+
+
+@app.get('/upload/jobs/{job_id}')
+async def upload_job_status(job_id: int):
+    job = await upload_job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404)
     return JSONResponse(
-        status_code=201,
-        content=json.loads(video.json()),
+        status_code=200,
+        content={
+            'job_id': job.id,
+            'request_id': job.request_id,
+            # queued, running, succeeded, rejected or failed
+            'status': job.status,
+            'attempts': job.attempts,
+            # the stored video once succeeded, the reason once rejected
+            'result': job.result,
+            'error': job.last_error,
+        },
     )
 
 
-@app.get('/requests')
-async def get_requests():
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
-    last_10_requests = await video_request_manager.get_last_10_requests()
-    return JSONResponse(
+def requests_page_response(requests, next_cursor):
+    return FastJSONResponse(
         status_code=200,
-        content={'requests': [json.loads(r.json()) for r in last_10_requests]},
+        content={
+            'requests': requests,
+            'next': next_cursor,
+        },
     )
 
 
+def invalid_cursor_response():
+    return JSONResponse(
+        status_code=400,
+        content={
+            'code': 'invalid_cursor',
+            'msg': 'cursor must be a value of the next field of a previous page'
+        }
+    )
+
+
+@app.get('/requests')
+async def get_requests(
+        limit: int = 10,
+        cursor: str = None,
+):
+    try:
+        requests, next_cursor = await video_request_manager.get_requests(
+            limit=limit,
+            cursor=cursor,
+        )
+    except InvalidCursor:
+        return invalid_cursor_response()
+    return requests_page_response(requests, next_cursor)
+
+
+def request_etag(request: VideoRequest) -> str:
+    # a request changes only once, when its video is attached
+    if not request.video:
+        return f'"{request.id}"'
+    return f'"{request.id}-{request.video.file_hash}-{int(request.video.uploaded_at.timestamp())}"'
+
+
+def request_cache_control(request: VideoRequest) -> str:
+    max_age = FULFILLED_REQUEST_MAX_AGE if request.video else OPEN_REQUEST_MAX_AGE
+    return f'public, max-age={max_age}'
+
+
 @app.get('/video/{request_id}')
 async def video_by_request_id(
         request_id: str,
+        if_none_match: str = Header(None),
 ):
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
     try:
         request = await video_request_manager.get_request(
             request_id=request_id,
@@ -147,6 +307,10 @@ async def video_by_request_id(
         return JSONResponse(status_code=404)
     if not request.video:
         return JSONResponse(status_code=404)
+    etag = request_etag(request)
+    cache_control = request_cache_control(request)
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return not_modified_response(etag, cache_control)
     return JSONResponse(
         status_code=200,
         content={
@@ -155,21 +319,30 @@ async def video_by_request_id(
             'cid': request.video.file_hash,
             'request': request_id,
             'abi': '0x' + encode(['address', 'string'], (request.video.uploader_address, request.video.file_hash)).hex(),
-        }
+        },
+        headers={'etag': etag, 'cache-control': cache_control},
     )
 
 
 @app.get('/requests/{request_id}')
 async def requests_by_id(
         request_id: str,
+        if_none_match: str = Header(None),
 ):
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
-    request = await video_request_manager.get_request(
-        request_id=request_id,
-    )
+    try:
+        request = await video_request_manager.get_request(
+            request_id=request_id,
+        )
+    except RequestNotFound:
+        return JSONResponse(status_code=404)
+    etag = request_etag(request)
+    cache_control = request_cache_control(request)
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return not_modified_response(etag, cache_control)
     return JSONResponse(
         status_code=200,
         content=json.loads(request.json()),
+        headers={'etag': etag, 'cache-control': cache_control},
     )
 
 
@@ -181,7 +354,6 @@ async def requests_by_location(
         hide_expired: bool = False,
         since_seconds: int = 3600 * 24 * 7
 ):
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
     requests = await video_request_manager.requests_by_location(
         lat=lat,
         long=long,
@@ -189,48 +361,137 @@ async def requests_by_location(
         hide_expired=hide_expired,
         since_seconds=since_seconds,
     )
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=200,
-        content={'requests': [json.loads(r.json()) for r in requests]},
+        content={'requests': requests},
     )
 
 
-@app.get('/requests_by_uploader/{address}')
-async def requests_by_uploader(
-        address: str,
+@app.get('/feed/requests')
+async def requests_feed(
+        http_request: Request,
+        lat: float,
+        long: float,
+        radius: int,
 ):
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
-    requests = await video_request_manager.requests_by_uploader_address(
-        address=address,
+    """Server-sent events with requests of the area as they are created (requested) or fulfilled."""
+    try:
+        subscription = request_feed.subscribe(lat, long, radius)
+    except FeedFull:
+        return JSONResponse(
+            status_code=503,
+            content={
+                'code': 'feed_full',
+                'msg': 'too many subscribers, poll /requests_by_location instead'
+            }
+        )
+    return StreamingResponse(
+        request_feed.stream(subscription, http_request.is_disconnected),
+        media_type='text/event-stream',
+        headers={'cache-control': 'no-cache'},
     )
-    return JSONResponse(
+
+
+@app.get('/map/cells')
+async def map_cells(
+        min_lat: float,
+        min_long: float,
+        max_lat: float,
+        max_long: float,
+        zoom: int,
+):
+    """Request counts per grid cell for zoomed out maps, a cell is 360 / 2^zoom degrees wide.
+
+    truncated is set when only the cells with the most requests are returned.
+    """
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_long <= 180 and -180 <= max_long <= 180):
+        return JSONResponse(
+            status_code=400,
+            content={
+                'code': 'invalid_bbox',
+                'msg': 'min_lat must not exceed max_lat, min_long > max_long crosses the antimeridian'
+            }
+        )
+    zoom = max(0, min(zoom, MAP_MAX_ZOOM))
+    cells, truncated = await video_request_manager.request_cells(
+        zoom=zoom,
+        min_lat=min_lat,
+        min_long=min_long,
+        max_lat=max_lat,
+        max_long=max_long,
+    )
+    return FastJSONResponse(
         status_code=200,
-        content={'requests': [json.loads(r.json()) for r in requests]},
+        content={'zoom': zoom, 'cells': cells, 'truncated': truncated},
     )
 
 
+@app.get('/requests_by_uploader/{address}')
+async def requests_by_uploader(
+        address: str,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: str = None,
+):
+    try:
+        requests, next_cursor = await video_request_manager.requests_by_uploader_address(
+            address=address,
+            limit=limit,
+            cursor=cursor,
+        )
+    except InvalidCursor:
+        return invalid_cursor_response()
+    return requests_page_response(requests, next_cursor)
+
+
 @app.get('/requests_by_requestor/{address}')
 async def requests_by_requestor(
         address: str,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: str = None,
 ):
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
-    requests = await video_request_manager.requests_by_requestor_address(
-        address=address,
-    )
+    try:
+        requests, next_cursor = await video_request_manager.requests_by_requestor_address(
+            address=address,
+            limit=limit,
+            cursor=cursor,
+        )
+    except InvalidCursor:
+        return invalid_cursor_response()
+    return requests_page_response(requests, next_cursor)
+
+
+@app.get('/internal/stats/cache')
+async def cache_stats():
     return JSONResponse(
         status_code=200,
-        content={'requests': [json.loads(r.json()) for r in requests]},
+        content={
+            **video_request_manager.cache_stats(),
+            'signatures': signature_recovery.stats(),
+        },
     )
 
 
+@app.post('/internal/signatures/recover')
+async def recover_signatures(signed_hashes: List[SignedVideoHash]):
+    """Recovers the signer of every video hash at once, null stands for an invalid signature."""
+    if len(signed_hashes) > SIGNATURE_BATCH_MAX_SIZE:
+        return JSONResponse(
+            status_code=413,
+            content={
+                'code': 'batch_too_large',
+                'msg': f'at most {SIGNATURE_BATCH_MAX_SIZE} signatures can be recovered at once'
+            }
+        )
+    addresses = await signature_recovery.get_addresses(
+        [(signed_hash.video_hash, signed_hash.signature) for signed_hash in signed_hashes]
+    )
+    return JSONResponse(status_code=200, content={'addresses': addresses})
+
+
 # handler uploads file to directory /root/videos, assignes hash, and returns it in Hash field
 @app.post('/api/v0/add')
 async def add_file(file: UploadFile = File(...)):
-    contents = await file.read()
-    file_hash = hashlib.sha256(contents).hexdigest()
-
-    with open(f'/videos/{file_hash}', 'wb') as f:
-        f.write(contents)
+    file_hash = await store_upload(file)
 
     return JSONResponse(
         status_code=200,
@@ -238,11 +499,70 @@ async def add_file(file: UploadFile = File(...)):
     )
 
 
+@app.on_event("startup")
+async def startup_db():
+    await apply_migrations(pg_conn_str)
+    await open_pool(pool)
+    asyncio.get_event_loop().create_task(check_pool_health(pool))
+    asyncio.get_event_loop().create_task(listen_for_invalidations(
+        pg_conn_str,
+        video_request_manager,
+        on_change=request_feed.changed,
+    ))
+    asyncio.get_event_loop().create_task(request_feed.run())
+
+
+@app.on_event("startup")
+def open_http_clients():
+    global http_client, verifier_client
+    http_client = create_http_client()
+    verifier_client = create_http_client(timeout=VERIFIER_TIMEOUT, uds=VERIFIER_UDS)
+
+
 @app.on_event("startup")
 def schedule_pull_video_requests():
     loop = asyncio.get_event_loop()
-    video_request_manager = VideoRequestManager(pg_conn_str=pg_conn_str)
-    loop.create_task(pull_video_requests(video_request_manager))
+    loop.create_task(pull_video_requests(video_request_manager, rpc_client))
+
+
+@app.on_event("startup")
+def schedule_submitter():
+    global submitter
+    submitter = TransactionSubmitter(contract_call_queue, rpc_client)
+    asyncio.get_event_loop().create_task(run_submitter(pg_conn_str, submitter))
+
+
+@app.on_event("startup")
+def schedule_upload_workers():
+    loop = asyncio.get_event_loop()
+    for _ in range(UPLOAD_JOB_CONCURRENCY):
+        loop.create_task(run_upload_worker(upload_job_queue, process_upload))
+
+
+@app.on_event("startup")
+def start_signature_workers():
+    signature_recovery.start()
+
+
+@app.on_event("shutdown")
+def stop_signature_workers():
+    signature_recovery.stop()
+
+
+@app.on_event("shutdown")
+async def shutdown_pool():
+    await close_pool(pool)
+
+
+@app.on_event("shutdown")
+async def shutdown_rpc_client():
+    await rpc_client.close()
+
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await http_client.aclose()
+    await verifier_client.aclose()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+import logging
+import os
+import re
+import sys
+from typing import List, Tuple
+
+import psycopg
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+# Arbitrary key of the advisory lock that serializes migrations between web workers
+MIGRATIONS_LOCK_ID = 7_262_533
+
+MIGRATION_FILE_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+def load_migrations(migrations_dir: str = MIGRATIONS_DIR) -> List[Tuple[int, str, str]]:
+    """Returns (version, name, sql) of every NNNN_name.sql file ordered by version."""
+    migrations = []
+    for file_name in os.listdir(migrations_dir):
+        match = MIGRATION_FILE_RE.match(file_name)
+        if not match:
+            continue
+        with open(os.path.join(migrations_dir, file_name)) as f:
+            migrations.append((int(match.group(1)), match.group(2), f.read()))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise Exception(f'duplicate migration versions in {migrations_dir}')
+    return migrations
+
+
+async def apply_migrations(pg_conn_str: str, migrations_dir: str = MIGRATIONS_DIR):
+    """Applies not yet applied migrations, each one in its own transaction."""
+    async with await psycopg.AsyncConnection.connect(pg_conn_str, autocommit=True) as conn:
+        await conn.execute('SELECT pg_advisory_lock(%s)', (MIGRATIONS_LOCK_ID,))
+        try:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migration (
+                    version INT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
+                )
+            ''')
+            cur = await conn.execute('SELECT version FROM schema_migration')
+            applied = {version for (version,) in await cur.fetchall()}
+
+            for version, name, sql in load_migrations(migrations_dir):
+                if version in applied:
+                    continue
+                logger.info(f'Applying migration {version:04d}_{name}')
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        'INSERT INTO schema_migration (version, name) VALUES (%s, %s)',
+                        (version, name),
+                    )
+        finally:
+            await conn.execute('SELECT pg_advisory_unlock(%s)', (MIGRATIONS_LOCK_ID,))
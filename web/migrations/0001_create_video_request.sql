@@ -1,3 +1,5 @@
+CREATE EXTENSION IF NOT EXISTS postgis;
+
 CREATE TABLE IF NOT EXISTS video_request (
     request_id TEXT PRIMARY KEY,
     request_tx_hash TEXT NULL,
@@ -18,3 +20,11 @@ CREATE TABLE IF NOT EXISTS video_request (
     actual_end_time TIMESTAMP NULL,
     file_hash TEXT NULL
 );
+
+-- Keyset pagination indexes, must match ORDER BY of VideoRequestManager._fetch_page
+CREATE INDEX IF NOT EXISTS video_request_end_time_idx
+    ON video_request (request_end_time DESC, request_id DESC);
+CREATE INDEX IF NOT EXISTS video_request_uploader_end_time_idx
+    ON video_request (uploader_address, request_end_time DESC, request_id DESC);
+CREATE INDEX IF NOT EXISTS video_request_requestor_end_time_idx
+    ON video_request (requestor_address, request_end_time DESC, request_id DESC);
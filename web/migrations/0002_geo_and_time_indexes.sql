@@ -0,0 +1,24 @@
+-- request_location stores latitude as X and longitude as Y, geography expects
+-- the opposite order, so the indexed column flips them back.
+ALTER TABLE video_request
+    ADD COLUMN IF NOT EXISTS request_geog GEOGRAPHY(Point, 4326)
+    GENERATED ALWAYS AS (
+        ST_SetSRID(ST_MakePoint(ST_Y(request_location), ST_X(request_location)), 4326)::geography
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS video_request_geog_idx
+    ON video_request USING GIST (request_geog);
+
+CREATE INDEX IF NOT EXISTS video_request_start_time_idx
+    ON video_request (request_start_time);
+
+-- Featured requests are shown regardless of location and time window
+ALTER TABLE video_request
+    ADD COLUMN IF NOT EXISTS is_featured BOOLEAN NOT NULL DEFAULT FALSE;
+
+UPDATE video_request
+SET is_featured = TRUE
+WHERE request_id IN ('2', '3', '5', '22', '23', '24', '27', '30', '31', '52', '53', '54', '55', '56', '57', '58');
+
+CREATE INDEX IF NOT EXISTS video_request_featured_idx
+    ON video_request (request_id) WHERE is_featured;
@@ -0,0 +1,13 @@
+-- Web workers LISTEN on this channel to invalidate their request caches
+CREATE OR REPLACE FUNCTION notify_video_request_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('video_request_changed', NEW.request_id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS video_request_changed ON video_request;
+
+CREATE TRIGGER video_request_changed
+    AFTER INSERT OR UPDATE ON video_request
+    FOR EACH ROW EXECUTE FUNCTION notify_video_request_changed();
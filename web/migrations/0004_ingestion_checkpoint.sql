@@ -0,0 +1,12 @@
+-- Last block fully processed by each ingestion loop, replaces MAX(request_block_number) on restart
+CREATE TABLE IF NOT EXISTS ingestion_checkpoint (
+    name TEXT PRIMARY KEY,
+    last_block BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+INSERT INTO ingestion_checkpoint (name, last_block)
+SELECT 'video_requested', MAX(request_block_number)
+FROM video_request
+HAVING MAX(request_block_number) IS NOT NULL
+ON CONFLICT (name) DO NOTHING;
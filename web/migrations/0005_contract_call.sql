@@ -0,0 +1,19 @@
+-- Queue of checkRequest transactions, consumed by TransactionSubmitter
+CREATE TABLE IF NOT EXISTS contract_call (
+    id BIGSERIAL PRIMARY KEY,
+    request_id TEXT NOT NULL UNIQUE,
+    -- pending, sent, confirmed, reverted or failed
+    status TEXT NOT NULL DEFAULT 'pending',
+    nonce BIGINT NULL,
+    -- every broadcast version of the transaction, the last one has the highest gas price
+    tx_hashes TEXT[] NOT NULL DEFAULT '{}',
+    gas_price NUMERIC NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT now(),
+    sent_at TIMESTAMP NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS contract_call_open_idx
+    ON contract_call (status, id) WHERE status IN ('pending', 'sent');
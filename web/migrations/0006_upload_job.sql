@@ -0,0 +1,21 @@
+-- Uploads waiting for verification, consumed by run_upload_workers with FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS upload_job (
+    id BIGSERIAL PRIMARY KEY,
+    request_id TEXT NOT NULL,
+    -- Video stored once the upload is verified
+    video JSONB NOT NULL,
+    -- queued, running, succeeded, rejected or failed
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    result JSONB NULL,
+    last_error TEXT NULL,
+    -- retries are delayed with a backoff
+    run_after TIMESTAMP NOT NULL DEFAULT now(),
+    -- a running job whose worker died is claimed again after this
+    locked_until TIMESTAMP NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT now(),
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS upload_job_open_idx
+    ON upload_job (id) WHERE status IN ('queued', 'running');
@@ -0,0 +1,68 @@
+-- Per grid cell counters of the map endpoint, maintained by triggers so that
+-- add_request, add_requests and add_video update them in their own transaction.
+-- A cell of zoom z is 360 / 2^z degrees wide and high, cell_x counts from -180 longitude
+-- and cell_y from -90 latitude. Zoom levels 0 to 15 must match MAP_MAX_ZOOM in models.py.
+CREATE TABLE IF NOT EXISTS request_cell (
+    zoom SMALLINT NOT NULL,
+    cell_x INT NOT NULL,
+    cell_y INT NOT NULL,
+    requests INT NOT NULL DEFAULT 0,
+    fulfilled INT NOT NULL DEFAULT 0,
+    reward DECIMAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (zoom, cell_x, cell_y)
+);
+
+-- request_location stores latitude as X and longitude as Y
+CREATE OR REPLACE FUNCTION count_request_cells(
+    location GEOMETRY,
+    added_requests INT,
+    added_fulfilled INT,
+    added_reward DECIMAL
+) RETURNS void AS $$
+    INSERT INTO request_cell AS cell (zoom, cell_x, cell_y, requests, fulfilled, reward)
+    SELECT
+        zoom,
+        floor((ST_Y(location) + 180) / (360.0 / 2 ^ zoom))::INT,
+        floor((ST_X(location) + 90) / (360.0 / 2 ^ zoom))::INT,
+        added_requests,
+        added_fulfilled,
+        added_reward
+    FROM generate_series(0, 15) AS zoom
+    ON CONFLICT (zoom, cell_x, cell_y) DO UPDATE
+    SET requests = cell.requests + EXCLUDED.requests,
+        fulfilled = cell.fulfilled + EXCLUDED.fulfilled,
+        reward = cell.reward + EXCLUDED.reward;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION update_request_cells() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM count_request_cells(
+            NEW.request_location, 1, (NEW.file_hash IS NOT NULL)::INT, NEW.reward
+        );
+    ELSIF OLD.file_hash IS NULL AND NEW.file_hash IS NOT NULL THEN
+        PERFORM count_request_cells(NEW.request_location, 0, 1, 0);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS request_cell_counters ON video_request;
+
+CREATE TRIGGER request_cell_counters
+    AFTER INSERT OR UPDATE OF file_hash ON video_request
+    FOR EACH ROW EXECUTE FUNCTION update_request_cells();
+
+-- Requests stored before the trigger existed
+TRUNCATE request_cell;
+
+INSERT INTO request_cell (zoom, cell_x, cell_y, requests, fulfilled, reward)
+SELECT
+    zoom,
+    floor((ST_Y(request_location) + 180) / (360.0 / 2 ^ zoom))::INT,
+    floor((ST_X(request_location) + 90) / (360.0 / 2 ^ zoom))::INT,
+    count(*),
+    count(file_hash),
+    sum(reward)
+FROM video_request, generate_series(0, 15) AS zoom
+GROUP BY 1, 2, 3;
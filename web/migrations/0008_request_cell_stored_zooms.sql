@@ -0,0 +1,26 @@
+-- Only zoom levels 8 to 15 are counted by the trigger, lower ones are summed from zoom 8 on read.
+-- With the global zoom 0 cell and the few coarse cells every insert and upload locked the same
+-- counter rows until commit, so an ingestion batch blocked uploads anywhere in the world.
+-- Zoom levels 8 to 15 must match MAP_MIN_STORED_ZOOM and MAP_MAX_ZOOM in models.py.
+CREATE OR REPLACE FUNCTION count_request_cells(
+    location GEOMETRY,
+    added_requests INT,
+    added_fulfilled INT,
+    added_reward DECIMAL
+) RETURNS void AS $$
+    INSERT INTO request_cell AS cell (zoom, cell_x, cell_y, requests, fulfilled, reward)
+    SELECT
+        zoom,
+        floor((ST_Y(location) + 180) / (360.0 / 2 ^ zoom))::INT,
+        floor((ST_X(location) + 90) / (360.0 / 2 ^ zoom))::INT,
+        added_requests,
+        added_fulfilled,
+        added_reward
+    FROM generate_series(8, 15) AS zoom
+    ON CONFLICT (zoom, cell_x, cell_y) DO UPDATE
+    SET requests = cell.requests + EXCLUDED.requests,
+        fulfilled = cell.fulfilled + EXCLUDED.fulfilled,
+        reward = cell.reward + EXCLUDED.reward;
+$$ LANGUAGE sql;
+
+DELETE FROM request_cell WHERE zoom < 8;
@@ -1,16 +1,130 @@
+import base64
+import binascii
+import math
 from datetime import datetime, timedelta
 from decimal import Decimal
 
-import psycopg
 from psycopg.rows import Row
+from psycopg_pool import AsyncConnectionPool
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+VIDEO_REQUEST_COLUMNS = '''
+    request_id,
+    request_tx_hash,
+    request_block_number,
+    ST_x(request_location),
+    ST_y(request_location),
+    request_radius,
+    request_start_time,
+    request_end_time,
+    request_direction,
+    request_second_direction,
+    reward,
+    requestor_address,
+    uploader_address,
+    ST_x(actual_location),
+    ST_y(actual_location),
+    actual_median_direction,
+    uploaded_at,
+    actual_start_time,
+    actual_end_time,
+    file_hash
+'''
+
+# ST_DWithin on the geography column is answered by video_request_geog_idx,
+# featured requests come from the partial video_request_featured_idx.
+REQUESTS_BY_LOCATION_QUERY = f'''
+    SELECT {VIDEO_REQUEST_COLUMNS}
+    FROM video_request
+    WHERE
+        (
+            ST_DWithin(
+                request_geog,
+                ST_SetSRID(ST_MakePoint(%(long)s, %(lat)s), 4326)::geography,
+                %(radius)s,
+                false
+            )
+            AND (
+                request_end_time > %(end_time)s
+                OR file_hash IS NOT NULL
+            )
+            AND request_start_time > %(since)s
+        ) OR is_featured
+    ORDER BY request_end_time DESC
+'''
+
+# request_cell stores zoom levels from MAP_MIN_STORED_ZOOM to MAP_MAX_ZOOM, must match
+# migrations/0008_request_cell_stored_zooms.sql, lower ones are summed from MAP_MIN_STORED_ZOOM
+MAP_MIN_STORED_ZOOM = 8
+MAP_MAX_ZOOM = 15
+MAP_MAX_CELLS = 5000
+
+# Bounds are in stored cells, a stored cell is `factor` times smaller than a requested one
+REQUEST_CELLS_QUERY = '''
+    SELECT cell_x / %(factor)s, cell_y / %(factor)s, sum(requests), sum(fulfilled), sum(reward)
+    FROM request_cell
+    WHERE zoom = %(stored_zoom)s
+        AND cell_y BETWEEN %(min_y)s AND %(max_y)s
+        AND (
+            cell_x BETWEEN %(min_x)s AND %(max_x)s
+            -- a box crossing the antimeridian
+            OR (%(min_x)s > %(max_x)s AND (cell_x >= %(min_x)s OR cell_x <= %(max_x)s))
+        )
+    GROUP BY 1, 2
+    ORDER BY 3 DESC, 1, 2
+    LIMIT %(limit)s
+'''
+
+VIDEO_REQUEST_INSERT_COLUMNS = '''
+    request_id,
+    request_tx_hash,
+    request_block_number,
+    request_location,
+    request_radius,
+    request_start_time,
+    request_end_time,
+    request_direction,
+    request_second_direction,
+    reward,
+    requestor_address
+'''
+# Placeholders of one row, in the order of VideoRequestManager.to_insert_params
+VIDEO_REQUEST_INSERT_VALUES = '(%s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s, %s, %s, %s)'
+# Rows per INSERT statement, keeps the number of parameters below the protocol limit of 65535
+INSERT_BATCH_SIZE = 1000
 
 
 class RequestNotFound(Exception):
     pass
 
 
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(end_time: datetime, request_id: str) -> str:
+    raw = f'{end_time.isoformat()}|{request_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        end_time, request_id = raw.split('|', 1)
+        return datetime.fromisoformat(end_time), request_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def cell_size(zoom: int) -> float:
+    """Width and height of a request_cell of `zoom` in degrees."""
+    return 360 / 2 ** zoom
+
+
 class Location(BaseModel):
     lat: float
     long: float
@@ -27,6 +141,11 @@ class Video(BaseModel):
     file_hash: str
 
 
+class SignedVideoHash(BaseModel):
+    video_hash: str
+    signature: str
+
+
 class VideoRequest(BaseModel):
     id: str
     tx_hash: str = None
@@ -41,8 +160,8 @@ class VideoRequest(BaseModel):
 
 
 class VideoRequestManager:
-    def __init__(self, pg_conn_str: str):
-        self.pg_conn_str = pg_conn_str
+    def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
 
     @classmethod
     def to_video_request(cls, row: Row) -> VideoRequest:
@@ -82,54 +201,69 @@ class VideoRequestManager:
             )
         return video_request
 
-    async def add_request(self, request: VideoRequest):
-        async with await psycopg.AsyncConnection.connect(self.pg_conn_str, autocommit=True) as conn:
-            async with conn.cursor() as cur:
-                return await cur.execute('''
-                    INSERT INTO video_request 
-                    (
-                        request_id,
-                        request_tx_hash,
-                        request_block_number,
-                        request_location,
-                        request_radius, 
-                        request_start_time,
-                        request_end_time,
-                        request_direction,
-                        request_second_direction,
-                        reward,
-                        requestor_address
-                    ) VALUES (
-                        %s,
-                        %s,
-                        %s,
-                        ST_SetSRID(ST_MakePoint(%s, %s), 4326),
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s
-                    );
-                ''', (
-                        request.id,
-                        request.tx_hash,
-                        request.block_number,
-                        request.location.lat,
-                        request.location.long,
-                        request.location.radius,
-                        request.start_time,
-                        request.end_time,
-                        request.location.direction,
-                        request.second_direction,
-                        request.reward,
-                        request.address,
-                    )
-                )
+    @classmethod
+    def to_video_request_dict(cls, row: Row) -> dict:
+        """Same structure as VideoRequest without building the model, used by list endpoints.
+
+        Values keep their python types, responses.FastJSONResponse serializes them
+        the way VideoRequest.json() does.
+        """
+        request_id, request_tx_hash, request_block_number, lat, long, radius, start_time, end_time, \
+        direction, second_direction, reward, requestor_address, uploader_address, \
+        actual_lat, actual_long, actual_median_direction, \
+        uploaded_at, actual_start_time, actual_end_time, file_hash = row
+        video = None
+        if uploader_address:
+            video = {
+                'uploader_address': uploader_address,
+                'location': {
+                    'lat': actual_lat,
+                    'long': actual_long,
+                    'direction': actual_median_direction,
+                    'radius': radius,
+                },
+                'uploaded_at': uploaded_at,
+                'start_time': actual_start_time,
+                'end_time': actual_end_time,
+                'file_hash': file_hash,
+            }
+        return {
+            'id': request_id,
+            'tx_hash': request_tx_hash,
+            'block_number': request_block_number,
+            'location': {
+                'lat': lat,
+                'long': long,
+                'direction': direction,
+                'radius': radius,
+            },
+            'second_direction': second_direction,
+            'start_time': start_time,
+            'end_time': end_time,
+            'reward': reward,
+            'address': requestor_address,
+            'video': video,
+        }
+
+    @classmethod
+    def to_insert_params(cls, request: VideoRequest) -> tuple:
+        return (
+            request.id,
+            request.tx_hash,
+            request.block_number,
+            request.location.lat,
+            request.location.long,
+            request.location.radius,
+            request.start_time,
+            request.end_time,
+            request.location.direction,
+            request.second_direction,
+            request.reward,
+            request.address,
+        )
 
     async def add_video(self, request_id: str, video: Video):
-        async with await psycopg.AsyncConnection.connect(self.pg_conn_str, autocommit=True) as conn:
+        async with self.pool.connection() as conn:
             async with conn.cursor() as cur:
                 await cur.execute('''
                     UPDATE video_request
@@ -159,7 +293,7 @@ class VideoRequestManager:
                     )
 
     async def get_request(self, request_id: str) -> VideoRequest:
-        async with await psycopg.AsyncConnection.connect(self.pg_conn_str) as conn:
+        async with self.pool.connection() as conn:
             async with conn.cursor() as cur:
                 await cur.execute('''
                     SELECT
@@ -194,41 +328,27 @@ class VideoRequestManager:
                     raise RequestNotFound
                 return self.to_video_request(row)
 
-    async def get_last_10_requests(self) -> List[VideoRequest]:
-        async with await psycopg.AsyncConnection.connect(self.pg_conn_str) as conn:
+    async def get_requests_by_ids(self, request_ids: List[str]) -> List[dict]:
+        async with self.pool.connection() as conn:
             async with conn.cursor() as cur:
-                await cur.execute('''
-                    SELECT
-                        request_id,
-                        request_tx_hash,
-                        request_block_number,
-                        ST_x(request_location),
-                        ST_y(request_location),
-                        request_radius,
-                        request_start_time,
-                        request_end_time,
-                        request_direction,
-                        request_second_direction,
-                        reward,
-                        requestor_address,
-                        uploader_address,
-                        ST_x(actual_location),
-                        ST_y(actual_location),
-                        actual_median_direction,
-                        uploaded_at,
-                        actual_start_time,
-                        actual_end_time,
-                        file_hash
+                await cur.execute(f'''
+                    SELECT {VIDEO_REQUEST_COLUMNS}
                     FROM video_request
-                    ORDER BY request_end_time DESC
-                    LIMIT 10
-                '''
+                    WHERE request_id = ANY(%s)
+                ''', (request_ids,)
                 )
-                results = []
-                rows = await cur.fetchall()
-                for row in rows:
-                    results.append(self.to_video_request(row))
-                return results
+                return [self.to_video_request_dict(row) for row in await cur.fetchall()]
+
+    async def get_requests(
+            self,
+            limit: int = DEFAULT_PAGE_SIZE,
+            cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        return await self._fetch_page('TRUE', (), limit, cursor)
+
+    async def get_last_10_requests(self) -> List[dict]:
+        requests, _ = await self.get_requests(limit=10)
+        return requests
 
     async def requests_by_location(
             self,
@@ -237,137 +357,152 @@ class VideoRequestManager:
             radius: int,
             hide_expired: bool,
             since_seconds: int,
-    ) -> List[VideoRequest]:
+    ) -> List[dict]:
         end_time = datetime.utcnow() if hide_expired else datetime(1970, 1, 1)
         since = datetime.utcnow() - timedelta(seconds=since_seconds)
-        async with await psycopg.AsyncConnection.connect(self.pg_conn_str) as conn:
+        async with self.pool.connection() as conn:
             async with conn.cursor() as cur:
-                await cur.execute('''
-                    SELECT
-                        request_id,
-                        request_tx_hash,
-                        request_block_number,
-                        ST_x(request_location),
-                        ST_y(request_location),
-                        request_radius,
-                        request_start_time,
-                        request_end_time,
-                        request_direction,
-                        request_second_direction,
-                        reward,
-                        requestor_address,
-                        uploader_address,
-                        ST_x(actual_location),
-                        ST_y(actual_location),
-                        actual_median_direction,
-                        uploaded_at,
-                        actual_start_time,
-                        actual_end_time,
-                        file_hash
-                    FROM video_request
-                    WHERE
-                        (
-                            ST_DistanceSphere(request_location, ST_MakePoint(%s,%s)) <= %s
-                            AND (
-                                request_end_time > %s
-                                OR file_hash IS NOT NULL
-                            )
-                            AND request_start_time > %s
-                        ) OR (
-                            request_id in ('2', '3', '5', '22', '23', '24', '27', '30', '31', '52', '53', '54', '55', '56', '57', '58')
-                        )
-                    ORDER BY request_end_time DESC
-                ''', (lat, long, radius, end_time, since)
-                )
-                results = []
-                rows = await cur.fetchall()
-                for row in rows:
-                    results.append(self.to_video_request(row))
-                return results
+                await cur.execute(REQUESTS_BY_LOCATION_QUERY, {
+                    'lat': lat,
+                    'long': long,
+                    'radius': radius,
+                    'end_time': end_time,
+                    'since': since,
+                })
+                return [self.to_video_request_dict(row) for row in await cur.fetchall()]
 
     async def requests_by_uploader_address(
             self,
             address: str,
-    ) -> List[VideoRequest]:
-        async with await psycopg.AsyncConnection.connect(self.pg_conn_str) as conn:
+            limit: int = DEFAULT_PAGE_SIZE,
+            cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        return await self._fetch_page('uploader_address = %s', (address,), limit, cursor)
+
+    async def requests_by_requestor_address(
+            self,
+            address: str,
+            limit: int = DEFAULT_PAGE_SIZE,
+            cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        return await self._fetch_page('requestor_address = %s', (address,), limit, cursor)
+
+    async def _fetch_page(
+            self,
+            condition: str,
+            params: tuple,
+            limit: int,
+            cursor: Optional[str],
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Returns one page of requests as dicts ordered by (request_end_time, request_id) descending.
+
+        The page continues right after the row encoded in `cursor`, the returned
+        cursor points to the last row of the page or is None if it's the last one.
+        Every condition used here has a matching (..., request_end_time DESC, request_id DESC)
+        index in the migrations.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        if cursor:
+            condition = f'{condition} AND (request_end_time, request_id) < (%s, %s)'
+            params = params + decode_cursor(cursor)
+        async with self.pool.connection() as conn:
             async with conn.cursor() as cur:
-                await cur.execute('''
-                    SELECT
-                        request_id,
-                        request_tx_hash,
-                        request_block_number,
-                        ST_x(request_location),
-                        ST_y(request_location),
-                        request_radius,
-                        request_start_time,
-                        request_end_time,
-                        request_direction,
-                        request_second_direction,
-                        reward,
-                        requestor_address,
-                        uploader_address,
-                        ST_x(actual_location),
-                        ST_y(actual_location),
-                        actual_median_direction,
-                        uploaded_at,
-                        actual_start_time,
-                        actual_end_time,
-                        file_hash
+                # one extra row tells whether there is a next page
+                await cur.execute(f'''
+                    SELECT {VIDEO_REQUEST_COLUMNS}
                     FROM video_request
-                    WHERE uploader_address = %s
-                    ORDER BY request_end_time DESC
-                ''', (address,)
+                    WHERE {condition}
+                    ORDER BY request_end_time DESC, request_id DESC
+                    LIMIT %s
+                ''', params + (limit + 1,)
                 )
-                results = []
                 rows = await cur.fetchall()
-                for row in rows:
-                    results.append(self.to_video_request(row))
-                return results
+                results = [self.to_video_request_dict(row) for row in rows[:limit]]
+                next_cursor = None
+                if len(rows) > limit:
+                    next_cursor = encode_cursor(results[-1]['end_time'], results[-1]['id'])
+                return results, next_cursor
 
-    async def requests_by_requestor_address(
+    async def request_cells(
             self,
-            address: str,
-    ) -> List[VideoRequest]:
-        async with await psycopg.AsyncConnection.connect(self.pg_conn_str) as conn:
+            zoom: int,
+            min_lat: float,
+            min_long: float,
+            max_lat: float,
+            max_long: float,
+    ) -> Tuple[List[dict], bool]:
+        """Returns request counts of the non-empty grid cells intersecting the bounding box.
+
+        Open requests are the ones without a video, expired ones included.
+        At most MAP_MAX_CELLS cells with the most requests are returned,
+        the flag tells whether there were more.
+        """
+        zoom = max(0, min(zoom, MAP_MAX_ZOOM))
+        size = cell_size(zoom)
+        stored_zoom = max(zoom, MAP_MIN_STORED_ZOOM)
+        factor = 2 ** (stored_zoom - zoom)
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(REQUEST_CELLS_QUERY, {
+                    'stored_zoom': stored_zoom,
+                    'factor': factor,
+                    'min_x': math.floor((min_long + 180) / size) * factor,
+                    'max_x': (math.floor((max_long + 180) / size) + 1) * factor - 1,
+                    'min_y': math.floor((min_lat + 90) / size) * factor,
+                    'max_y': (math.floor((max_lat + 90) / size) + 1) * factor - 1,
+                    'limit': MAP_MAX_CELLS + 1,
+                })
+                rows = await cur.fetchall()
+                cells = [
+                    {
+                        'lat': (cell_y + 0.5) * size - 90,
+                        'long': (cell_x + 0.5) * size - 180,
+                        'size': size,
+                        'requests': requests,
+                        'open': requests - fulfilled,
+                        'fulfilled': fulfilled,
+                        'reward': reward,
+                    }
+                    for cell_x, cell_y, requests, fulfilled, reward in rows[:MAP_MAX_CELLS]
+                ]
+                return cells, len(rows) > MAP_MAX_CELLS
+
+    async def get_checkpoint(self, name: str) -> Optional[int]:
+        """Returns the last block fully processed by the ingestion loop `name`."""
+        async with self.pool.connection() as conn:
             async with conn.cursor() as cur:
                 await cur.execute('''
-                    SELECT
-                        request_id,
-                        request_tx_hash,
-                        request_block_number,
-                        ST_x(request_location),
-                        ST_y(request_location),
-                        request_radius,
-                        request_start_time,
-                        request_end_time,
-                        request_direction,
-                        request_second_direction,
-                        reward,
-                        requestor_address,
-                        uploader_address,
-                        ST_x(actual_location),
-                        ST_y(actual_location),
-                        actual_median_direction,
-                        uploaded_at,
-                        actual_start_time,
-                        actual_end_time,
-                        file_hash
-                    FROM video_request
-                    WHERE requestor_address = %s
-                    ORDER BY request_end_time DESC
-                ''', (address,)
+                    SELECT last_block
+                    FROM ingestion_checkpoint
+                    WHERE name = %s
+                ''', (name,)
                 )
-                results = []
-                rows = await cur.fetchall()
-                for row in rows:
-                    results.append(self.to_video_request(row))
-                return results
+                row = await cur.fetchone()
+                return row[0] if row else None
+
+    async def add_requests(self, requests: List[VideoRequest], checkpoint: str, last_block: int):
+        """Inserts requests of a block range and moves the checkpoint past it in one transaction.
 
-    async def max_request_block_number(self):
-        async with await psycopg.AsyncConnection.connect(self.pg_conn_str) as conn:
+        Requests which are already stored are skipped, so a range can be safely processed twice.
+        """
+        async with self.pool.connection() as conn:
             async with conn.cursor() as cur:
+                for i in range(0, len(requests), INSERT_BATCH_SIZE):
+                    batch = requests[i:i + INSERT_BATCH_SIZE]
+                    values = ', '.join([VIDEO_REQUEST_INSERT_VALUES] * len(batch))
+                    params = []
+                    for request in batch:
+                        params.extend(self.to_insert_params(request))
+                    await cur.execute(f'''
+                        INSERT INTO video_request ({VIDEO_REQUEST_INSERT_COLUMNS})
+                        VALUES {values}
+                        ON CONFLICT (request_id) DO NOTHING
+                    ''', params
+                    )
                 await cur.execute('''
-                    SELECT MAX(request_block_number)
-                    FROM video_request;
-                ''')
-                return await cur.fetchone()
+                    INSERT INTO ingestion_checkpoint (name, last_block)
+                    VALUES (%s, %s)
+                    ON CONFLICT (name) DO UPDATE
+                    SET last_block = EXCLUDED.last_block, updated_at = now()
+                ''', (checkpoint, last_block)
+                )
@@ -0,0 +1,28 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse, Response
+
+
+def json_default(value: Any) -> Any:
+    # pydantic serializes Decimal as a number too
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class FastJSONResponse(JSONResponse):
+    """Serializes dicts, datetimes and Decimals straight to bytes with orjson.
+
+    Renders the same JSON as json.loads(model.json()) passed to JSONResponse,
+    without the intermediate string and dicts.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=json_default)
+
+
+def not_modified_response(etag: str, cache_control: str) -> Response:
+    # a 304 repeats the headers a 200 would have sent
+    return Response(status_code=304, headers={'etag': etag, 'cache-control': cache_control})
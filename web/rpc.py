@@ -0,0 +1,126 @@
+import itertools
+import logging
+import os
+import sys
+from typing import Any, List, Optional, Sequence, Tuple
+
+import httpx
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+RPC_TIMEOUT = float(os.getenv('RPC_TIMEOUT', 30))
+RPC_MAX_CONNECTIONS = int(os.getenv('RPC_MAX_CONNECTIONS', 10))
+RPC_KEEPALIVE_EXPIRY = float(os.getenv('RPC_KEEPALIVE_EXPIRY', 60))
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+class RPCError(Exception):
+    def __init__(self, method: str, error: dict):
+        self.method = method
+        self.code = error.get('code')
+        self.message = error.get('message')
+        self.data = error.get('data')
+        super().__init__(f'{method} failed with {self.code}: {self.message}')
+
+
+def format_log(log: dict) -> AttributeDict:
+    """Converts a raw eth_getLogs entry to the form web3 contract events decode."""
+    return AttributeDict({
+        'address': log['address'],
+        'topics': [HexBytes(topic) for topic in log['topics']],
+        'data': log['data'],
+        'blockNumber': int(log['blockNumber'], 16),
+        'blockHash': HexBytes(log['blockHash']),
+        'transactionHash': HexBytes(log['transactionHash']),
+        'transactionIndex': int(log['transactionIndex'], 16),
+        'logIndex': int(log['logIndex'], 16),
+        'removed': log.get('removed', False),
+    })
+
+
+class JSONRPCClient:
+    """Async JSON-RPC client over a keep-alive connection pool.
+
+    Several calls can be sent in one HTTP round-trip with `batch`.
+    """
+
+    def __init__(self, url: str, transport: httpx.AsyncBaseTransport = None):
+        self.url = url
+        self._ids = itertools.count(1)
+        self._client = httpx.AsyncClient(
+            timeout=RPC_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=RPC_MAX_CONNECTIONS,
+                max_keepalive_connections=RPC_MAX_CONNECTIONS,
+                keepalive_expiry=RPC_KEEPALIVE_EXPIRY,
+            ),
+            transport=transport,
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+    def _request(self, method: str, params: Sequence[Any]) -> dict:
+        return {'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': list(params)}
+
+    async def call(self, method: str, *params) -> Any:
+        request = self._request(method, params)
+        resp = await self._client.post(self.url, json=request)
+        resp.raise_for_status()
+        response = resp.json()
+        if 'error' in response:
+            raise RPCError(method, response['error'])
+        return response['result']
+
+    async def batch(self, calls: Sequence[Tuple[str, Sequence[Any]]]) -> List[Any]:
+        """Sends (method, params) calls in a single request, results are returned in the same order.
+
+        Failed calls are returned as RPCError instances instead of raising, so that
+        one failure doesn't hide the results of the other calls.
+        RPCError is raised when the node rejects the whole batch.
+        """
+        if not calls:
+            return []
+        requests = [self._request(method, params) for method, params in calls]
+        resp = await self._client.post(self.url, json=requests)
+        resp.raise_for_status()
+        body = resp.json()
+        # a batch which is too large, rate limited or unparsable is answered with a single error
+        if isinstance(body, dict):
+            raise RPCError('batch', body.get('error') or {'message': 'not a batch response'})
+        # responses of a batch may come in any order
+        responses = {response.get('id'): response for response in body if isinstance(response, dict)}
+        results = []
+        for request in requests:
+            response = responses.get(request['id'])
+            if response is None:
+                results.append(RPCError(request['method'], {'message': 'missing from batch response'}))
+            elif 'error' in response:
+                results.append(RPCError(request['method'], response['error']))
+            else:
+                results.append(response['result'])
+        return results
+
+    async def chain_id(self) -> int:
+        return int(await self.call('eth_chainId'), 16)
+
+    async def block_number(self) -> int:
+        return int(await self.call('eth_blockNumber'), 16)
+
+    async def gas_price(self) -> int:
+        return int(await self.call('eth_gasPrice'), 16)
+
+    async def get_transaction_count(self, address: str, block: str = 'pending') -> int:
+        return int(await self.call('eth_getTransactionCount', address, block), 16)
+
+    async def estimate_gas(self, tx: dict) -> int:
+        return int(await self.call('eth_estimateGas', tx), 16)
+
+    async def send_raw_transaction(self, raw_tx: bytes) -> str:
+        return await self.call('eth_sendRawTransaction', HexBytes(raw_tx).hex())
+
+    async def get_transaction_receipt(self, tx_hash: str) -> Optional[dict]:
+        """Returns None while the transaction isn't mined."""
+        return await self.call('eth_getTransactionReceipt', tx_hash)
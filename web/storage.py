@@ -0,0 +1,51 @@
+import hashlib
+import logging
+import os
+import sys
+import uuid
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+
+VIDEOS_DIR = os.getenv('VIDEOS_DIR', '/videos')
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+def video_path(file_hash: str) -> str:
+    return os.path.join(VIDEOS_DIR, file_hash)
+
+
+async def store_upload(file: UploadFile) -> str:
+    """Streams the upload into VIDEOS_DIR and returns its sha256 hash.
+
+    The file is read in UPLOAD_CHUNK_SIZE chunks into a temp file next to the
+    final location and atomically renamed to its hash, so readers never see
+    a partially written video. If a video with the same hash is already
+    stored, the temp file is dropped instead.
+    """
+    sha256 = hashlib.sha256()
+    tmp_path = os.path.join(VIDEOS_DIR, f'.upload-{uuid.uuid4().hex}')
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as out_file:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                await out_file.write(chunk)
+
+        file_hash = sha256.hexdigest()
+        if await aiofiles.os.path.exists(video_path(file_hash)):
+            logger.info(f'Video {file_hash} is already stored, skipping')
+            await aiofiles.os.remove(tmp_path)
+        else:
+            await aiofiles.os.replace(tmp_path, video_path(file_hash))
+        return file_hash
+    except BaseException:
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+        raise
@@ -0,0 +1,418 @@
+import asyncio
+import logging
+import os
+import sys
+from decimal import Decimal
+from typing import List, Optional, Tuple, Union
+
+import psycopg
+from eth_account import Account
+from hexbytes import HexBytes
+from psycopg_pool import AsyncConnectionPool
+
+from contract import (
+    CONTRACT_CALLER_ADDR,
+    CONTRACT_CALLER_PRIVATE_KEY,
+    VIDEO_REQUESTER_CONTRACT_ADDR,
+    contract_instance,
+)
+from rpc import JSONRPCClient, RPCError
+
+SUBMITTER_INTERVAL = float(os.getenv('SUBMITTER_INTERVAL', 2))
+SUBMITTER_BATCH_SIZE = int(os.getenv('SUBMITTER_BATCH_SIZE', 50))
+# A sent transaction without a receipt after this many seconds is resent with a higher gas price
+TX_STUCK_AFTER = float(os.getenv('TX_STUCK_AFTER', 120))
+# Nodes only accept a replacement with at least 10% higher gas price
+TX_GAS_BUMP_PERCENT = int(os.getenv('TX_GAS_BUMP_PERCENT', 20))
+TX_MAX_GAS_PRICE = int(os.getenv('TX_MAX_GAS_PRICE', 0)) or None
+TX_MAX_ATTEMPTS = int(os.getenv('TX_MAX_ATTEMPTS', 5))
+# Gas of a plain transfer, used by the empty transactions filling nonce gaps
+TRANSFER_GAS = 21000
+# Only one web worker submits transactions, the others wait for this advisory lock
+SUBMITTER_LOCK_ID = 7_262_534
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+class ContractCallQueue:
+    """Durable queue of checkRequest calls stored in the contract_call table."""
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
+
+    async def enqueue(self, request_id: str):
+        async with self.pool.connection() as conn:
+            await conn.execute('''
+                INSERT INTO contract_call (request_id)
+                VALUES (%s)
+                ON CONFLICT (request_id) DO NOTHING
+            ''', (request_id,)
+            )
+
+    async def pending(self, limit: int) -> List[Tuple[int, str]]:
+        """Returns (id, request_id) of calls which weren't sent yet, oldest first."""
+        async with self.pool.connection() as conn:
+            cur = await conn.execute('''
+                SELECT id, request_id
+                FROM contract_call
+                WHERE status = 'pending'
+                ORDER BY id
+                LIMIT %s
+            ''', (limit,)
+            )
+            return await cur.fetchall()
+
+    async def sent(self) -> List[Tuple[int, str, int, List[str], Decimal, int, bool]]:
+        """Returns (id, request_id, nonce, tx_hashes, gas_price, attempts, is_stuck) of calls awaiting a receipt."""
+        async with self.pool.connection() as conn:
+            cur = await conn.execute('''
+                SELECT
+                    id,
+                    request_id,
+                    nonce,
+                    tx_hashes,
+                    gas_price,
+                    attempts,
+                    sent_at < now() - make_interval(secs => %s)
+                FROM contract_call
+                WHERE status = 'sent'
+                ORDER BY nonce
+            ''', (TX_STUCK_AFTER,)
+            )
+            return await cur.fetchall()
+
+    async def max_nonce(self) -> Optional[int]:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute('''
+                SELECT MAX(nonce)
+                FROM contract_call
+                WHERE nonce IS NOT NULL
+            ''')
+            return (await cur.fetchone())[0]
+
+    async def mark_sent(self, call_id: int, nonce: int, tx_hash: str, gas_price: int):
+        async with self.pool.connection() as conn:
+            await conn.execute('''
+                UPDATE contract_call
+                SET status = 'sent',
+                    nonce = %s,
+                    tx_hashes = array_append(tx_hashes, %s),
+                    gas_price = %s,
+                    attempts = attempts + 1,
+                    last_error = NULL,
+                    sent_at = now(),
+                    updated_at = now()
+                WHERE id = %s
+            ''', (nonce, tx_hash, gas_price, call_id)
+            )
+
+    async def mark_done(self, call_id: int, status: str):
+        async with self.pool.connection() as conn:
+            await conn.execute('''
+                UPDATE contract_call
+                SET status = %s, updated_at = now()
+                WHERE id = %s
+            ''', (status, call_id)
+            )
+
+    async def record_error(self, call_id: int, error: str):
+        """Records an error which doesn't count as an attempt, e.g. a rejected replacement."""
+        async with self.pool.connection() as conn:
+            await conn.execute('''
+                UPDATE contract_call
+                SET last_error = %s, updated_at = now()
+                WHERE id = %s
+            ''', (error, call_id)
+            )
+
+    async def mark_error(self, call_id: int, error: str):
+        """Records a failed attempt, the call is given up after TX_MAX_ATTEMPTS."""
+        async with self.pool.connection() as conn:
+            await conn.execute('''
+                UPDATE contract_call
+                SET attempts = attempts + 1,
+                    last_error = %s,
+                    status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE status END,
+                    updated_at = now()
+                WHERE id = %s
+            ''', (error, TX_MAX_ATTEMPTS, call_id)
+            )
+
+
+def nonce_gaps(chain_nonce: int, held_nonces: List[int]) -> List[int]:
+    """Nonces below the highest held one which no transaction waiting for inclusion uses.
+
+    `chain_nonce` is the pending transaction count, every nonce below it is already used.
+    A transaction after a gap is never mined, however high its gas price is.
+    """
+    if not held_nonces:
+        return []
+    held = set(held_nonces)
+    return [nonce for nonce in range(chain_nonce, max(held)) if nonce not in held]
+
+
+class NonceManager:
+    """Hands out consecutive nonces locally instead of asking the node for every transaction."""
+
+    def __init__(self):
+        self.next_nonce = None
+        # nonces of transactions the node rejected, they are reused first so that there is no gap
+        self.released = []
+
+    def sync(self, chain_nonce: int, max_local_nonce: Optional[int]):
+        # transactions sent before a restart may still be missing from the node's pending pool
+        local_nonce = max_local_nonce + 1 if max_local_nonce is not None else 0
+        self.next_nonce = max(chain_nonce, local_nonce)
+        self.released = sorted(nonce for nonce in self.released if chain_nonce <= nonce < self.next_nonce)
+
+    def take(self) -> int:
+        if self.released:
+            return self.released.pop(0)
+        nonce = self.next_nonce
+        self.next_nonce += 1
+        return nonce
+
+    def release(self, nonce: int):
+        self.released.append(nonce)
+        self.released.sort()
+
+    def forget(self, nonces: List[int]):
+        """Drops released nonces which were used by something else."""
+        self.released = [nonce for nonce in self.released if nonce not in nonces]
+
+
+class TransactionSubmitter:
+    """Sends queued checkRequest calls, resends stuck ones with a higher gas price and polls receipts.
+
+    Uploads only enqueue calls, so a burst of uploads doesn't wait on RPC round-trips
+    and doesn't race for nonces. Transactions are built and signed locally, the node
+    is called with batches covering the whole queue.
+    """
+
+    def __init__(self, queue: ContractCallQueue, rpc: JSONRPCClient):
+        self.queue = queue
+        self.rpc = rpc
+        self.contract = contract_instance()
+        self.chain_id = None
+        self.nonces = NonceManager()
+        self._wake = asyncio.Event()
+
+    def wake(self):
+        """Makes the submitter look at the queue right away instead of after SUBMITTER_INTERVAL."""
+        self._wake.set()
+
+    async def sync_nonce(self):
+        chain_id, chain_nonce = await self.rpc.batch([
+            ('eth_chainId', []),
+            ('eth_getTransactionCount', [CONTRACT_CALLER_ADDR, 'pending']),
+        ])
+        for result in (chain_id, chain_nonce):
+            if isinstance(result, RPCError):
+                raise result
+        self.chain_id = int(chain_id, 16)
+        self.nonces.sync(int(chain_nonce, 16), await self.queue.max_nonce())
+        logger.info(f'Next nonce of {CONTRACT_CALLER_ADDR} is {self.nonces.next_nonce}')
+
+    def cap_gas_price(self, gas_price: int) -> int:
+        return min(gas_price, TX_MAX_GAS_PRICE) if TX_MAX_GAS_PRICE else gas_price
+
+    def call_data(self, request_id: str) -> str:
+        return self.contract.encodeABI(fn_name='checkRequest', args=[int(request_id)])
+
+    async def estimate(self, request_ids: List[str]) -> Tuple[int, List[Union[int, RPCError]]]:
+        """Returns the gas price and the gas limit of a checkRequest call for every request, in one batch."""
+        results = await self.rpc.batch([('eth_gasPrice', [])] + [
+            ('eth_estimateGas', [{
+                'from': CONTRACT_CALLER_ADDR,
+                'to': VIDEO_REQUESTER_CONTRACT_ADDR,
+                'data': self.call_data(request_id),
+            }])
+            for request_id in request_ids
+        ])
+        if isinstance(results[0], RPCError):
+            raise results[0]
+        gas_price = self.cap_gas_price(int(results[0], 16))
+        return gas_price, [gas if isinstance(gas, RPCError) else int(gas, 16) for gas in results[1:]]
+
+    def sign(self, request_id: str, nonce: int, gas_price: int, gas: int) -> bytes:
+        # Doesn't seem like a good idea to store the private key on the backend.
+        # It's a quick and dirty implementation for PoC.
+        # For production we must rethink the flow so that the backend doesn't transact any funds.
+        signed_tx = Account.sign_transaction({
+            'to': VIDEO_REQUESTER_CONTRACT_ADDR,
+            'data': self.call_data(request_id),
+            'value': 0,
+            'nonce': nonce,
+            'gas': gas,
+            'gasPrice': gas_price,
+            'chainId': self.chain_id,
+        }, private_key=CONTRACT_CALLER_PRIVATE_KEY)
+        return signed_tx.rawTransaction
+
+    def sign_empty(self, nonce: int, gas_price: int) -> bytes:
+        """Zero value transfer to the caller itself, it only uses up the nonce."""
+        signed_tx = Account.sign_transaction({
+            'to': CONTRACT_CALLER_ADDR,
+            'value': 0,
+            'nonce': nonce,
+            'gas': TRANSFER_GAS,
+            'gasPrice': gas_price,
+            'chainId': self.chain_id,
+        }, private_key=CONTRACT_CALLER_PRIVATE_KEY)
+        return signed_tx.rawTransaction
+
+    async def send(self, txs: List[Tuple[int, str, int, int, int]], replacing: bool = False) -> List[int]:
+        """Sends (call_id, request_id, nonce, gas_price, gas) transactions in one batch, returns rejected nonces.
+
+        A rejected replacement keeps its nonce, the original transaction may still be mined.
+        """
+        results = await self.rpc.batch([
+            ('eth_sendRawTransaction', [HexBytes(self.sign(request_id, nonce, gas_price, gas)).hex()])
+            for _, request_id, nonce, gas_price, gas in txs
+        ])
+        rejected = []
+        for (call_id, request_id, nonce, gas_price, _), result in zip(txs, results):
+            if isinstance(result, RPCError):
+                # e.g. "nonce too low" when one of the previous versions has just been mined
+                logger.info(f'checkRequest for request {request_id} with nonce {nonce} was rejected: {result}')
+                if replacing:
+                    await self.queue.record_error(call_id, str(result))
+                    continue
+                await self.queue.mark_error(call_id, str(result))
+                rejected.append(nonce)
+                continue
+            logger.info(
+                f'Sent checkRequest of contract {VIDEO_REQUESTER_CONTRACT_ADDR} for request {request_id}: '
+                f'{result}, nonce {nonce}, gas price {gas_price}'
+            )
+            await self.queue.mark_sent(call_id, nonce, result, gas_price)
+        return rejected
+
+    async def submit_pending(self):
+        calls = await self.queue.pending(SUBMITTER_BATCH_SIZE)
+        if not calls:
+            return
+        gas_price, gas_limits = await self.estimate([request_id for _, request_id in calls])
+        txs = []
+        for (call_id, request_id), gas in zip(calls, gas_limits):
+            if isinstance(gas, RPCError):
+                # the call would revert, no nonce is spent on it
+                await self.queue.mark_error(call_id, str(gas))
+                continue
+            txs.append((call_id, request_id, self.nonces.take(), gas_price, gas))
+        try:
+            rejected = await self.send(txs)
+        except Exception:
+            # the batch failed as a whole, e.g. a timeout, none of the nonces is known to be used
+            for _, _, nonce, _, _ in txs:
+                self.nonces.release(nonce)
+            await self.sync_nonce()
+            raise
+        if rejected:
+            # unused nonces would leave a gap blocking every later transaction
+            for nonce in rejected:
+                self.nonces.release(nonce)
+            await self.sync_nonce()
+
+    async def check_sent(self):
+        sent = await self.queue.sent()
+        if not sent:
+            return
+        # receipts of every version of every sent transaction and the pending nonce in one batch
+        tx_hashes = [tx_hash for _, _, _, hashes, _, _, _ in sent for tx_hash in hashes]
+        results = await self.rpc.batch(
+            [('eth_getTransactionReceipt', [tx_hash]) for tx_hash in tx_hashes]
+            + [('eth_getTransactionCount', [CONTRACT_CALLER_ADDR, 'pending'])]
+        )
+        results, chain_nonce = results[:-1], results[-1]
+        if isinstance(chain_nonce, RPCError):
+            raise chain_nonce
+        receipts = {
+            tx_hash: receipt
+            for tx_hash, receipt in zip(tx_hashes, results)
+            if receipt is not None and not isinstance(receipt, RPCError)
+        }
+
+        stuck = []
+        waiting_nonces = []
+        for call_id, request_id, nonce, hashes, gas_price, attempts, is_stuck in sent:
+            receipt = next((receipts[tx_hash] for tx_hash in reversed(hashes) if tx_hash in receipts), None)
+            if receipt is not None:
+                status = 'confirmed' if int(receipt['status'], 16) == 1 else 'reverted'
+                logger.info(f'checkRequest for request {request_id} is {status}: {receipt["transactionHash"]}')
+                await self.queue.mark_done(call_id, status)
+            elif not is_stuck:
+                waiting_nonces.append(nonce)
+            elif attempts >= TX_MAX_ATTEMPTS:
+                logger.info(f'Giving up checkRequest for request {request_id} after {attempts} attempts')
+                await self.queue.mark_done(call_id, 'failed')
+            else:
+                waiting_nonces.append(nonce)
+                stuck.append((call_id, request_id, nonce, gas_price))
+        if not stuck:
+            return
+
+        current_gas_price, gas_limits = await self.estimate([request_id for _, request_id, _, _ in stuck])
+        # a stuck transaction may wait behind a nonce nothing uses anymore,
+        # e.g. one of a call given up on or of a batch lost before a restart
+        await self.fill_nonce_gaps(int(chain_nonce, 16), waiting_nonces, current_gas_price)
+        txs = []
+        for (call_id, request_id, nonce, gas_price), gas in zip(stuck, gas_limits):
+            if isinstance(gas, RPCError):
+                # the original may have been mined meanwhile, so the call isn't failed for that
+                await self.queue.record_error(call_id, str(gas))
+                continue
+            bumped_gas_price = self.cap_gas_price(
+                max(int(gas_price) * (100 + TX_GAS_BUMP_PERCENT) // 100, current_gas_price)
+            )
+            if bumped_gas_price <= gas_price:
+                # capped by TX_MAX_GAS_PRICE, the node would reject it as underpriced
+                continue
+            # same nonce, so the replacement and the original can't both be mined
+            txs.append((call_id, request_id, nonce, bumped_gas_price, gas))
+        await self.send(txs, replacing=True)
+
+    async def fill_nonce_gaps(self, chain_nonce: int, waiting_nonces: List[int], gas_price: int):
+        gaps = nonce_gaps(chain_nonce, waiting_nonces)
+        if not gaps:
+            return
+        logger.info(f'Filling nonce gaps {gaps} of {CONTRACT_CALLER_ADDR} with empty transactions')
+        results = await self.rpc.batch([
+            ('eth_sendRawTransaction', [HexBytes(self.sign_empty(nonce, gas_price)).hex()])
+            for nonce in gaps
+        ])
+        for nonce, result in zip(gaps, results):
+            if isinstance(result, RPCError):
+                logger.info(f'Empty transaction with nonce {nonce} was rejected: {result}')
+        self.nonces.forget(gaps)
+
+    async def run(self, lock_conn: psycopg.AsyncConnection):
+        await self.sync_nonce()
+        while True:
+            # losing the connection releases the lock, another worker may take over
+            await lock_conn.execute('SELECT 1')
+            try:
+                await self.submit_pending()
+                await self.check_sent()
+            except Exception as e:
+                logger.exception(e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), SUBMITTER_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+async def run_submitter(pg_conn_str: str, submitter: TransactionSubmitter):
+    """Runs the submitter in the worker holding the advisory lock."""
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(pg_conn_str, autocommit=True) as conn:
+                cur = await conn.execute('SELECT pg_try_advisory_lock(%s)', (SUBMITTER_LOCK_ID,))
+                if (await cur.fetchone())[0]:
+                    logger.info('Acquired transaction submitter lock')
+                    await submitter.run(conn)
+        except Exception as e:
+            logger.exception(e)
+        await asyncio.sleep(SUBMITTER_INTERVAL)
@@ -1,12 +1,106 @@
-from web3.auto import w3
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from eth_account import Account
 from eth_account.messages import encode_defunct
 
+from ttl_cache import LRUCache, MISSING
+
+# Recovery is pure python ECDSA, so it runs in worker processes to keep the event loop responsive
+SIGNATURE_WORKERS = int(os.getenv('SIGNATURE_WORKERS', 2))
+SIGNATURE_CACHE_MAX_SIZE = int(os.getenv('SIGNATURE_CACHE_MAX_SIZE', 10000))
+# Max signatures per batch recovery, a bigger batch would hold every worker
+SIGNATURE_BATCH_MAX_SIZE = int(os.getenv('SIGNATURE_BATCH_MAX_SIZE', 100))
+
+
+def video_hash_message(video_hash: str) -> str:
+    return f'video hash: {video_hash}'
 
-def get_address(video_hash, signature):
-    message = f'video hash: {video_hash}'
-    print(message)
 
-    return w3.eth.account.recover_message(
+def recover_address(message: str, signature: str) -> str:
+    return Account.recover_message(
         encode_defunct(text=message),
         signature=signature,
     )
+
+
+def recover_addresses(items: Sequence[Tuple[str, str]]) -> List[Optional[str]]:
+    """Recovers (message, signature) pairs, None stands for an invalid signature."""
+    addresses = []
+    for message, signature in items:
+        try:
+            addresses.append(recover_address(message, signature))
+        except Exception:
+            addresses.append(None)
+    return addresses
+
+
+def get_address(video_hash, signature):
+    return recover_address(video_hash_message(video_hash), signature)
+
+
+class SignatureRecovery:
+    """Recovers signer addresses in a process pool behind an LRU memo keyed by (message, signature).
+
+    Clients retry uploads with the same signature, those are answered from the memo.
+    """
+
+    def __init__(self, workers: int = SIGNATURE_WORKERS, cache_max_size: int = SIGNATURE_CACHE_MAX_SIZE):
+        self.workers = workers
+        # the recovered address of a signature never changes, so entries don't expire
+        self.cache = LRUCache(max_size=cache_max_size, ttl=float('inf'))
+        self.executor = None
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+
+    def stop(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def get_address(self, video_hash: str, signature: str) -> str:
+        """Raises like get_address for an invalid signature."""
+        key = (video_hash_message(video_hash), signature)
+        address = self.cache.get(key)
+        if address is MISSING:
+            loop = asyncio.get_running_loop()
+            address = await loop.run_in_executor(self.executor, recover_address, *key)
+            self.cache.set(key, address, self.cache.generation)
+        return address
+
+    async def get_addresses(self, items: Sequence[Tuple[str, str]]) -> List[Optional[str]]:
+        """Recovers (video_hash, signature) pairs at once, None stands for an invalid signature."""
+        keys = [(video_hash_message(video_hash), signature) for video_hash, signature in items]
+        addresses = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            address = self.cache.get(key)
+            if address is MISSING:
+                missing.append(key)
+            else:
+                addresses[key] = address
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            # one chunk per worker, so the pool isn't flooded with tiny tasks
+            chunk_size = -(-len(missing) // self.workers)
+            chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self.executor, recover_addresses, chunk)
+                for chunk in chunks
+            ])
+            for chunk, chunk_addresses in zip(chunks, results):
+                for key, address in zip(chunk, chunk_addresses):
+                    addresses[key] = address
+                    if address is not None:
+                        self.cache.set(key, address, self.cache.generation)
+        return [addresses[key] for key in keys]
+
+    def stats(self) -> dict:
+        # the infinite ttl isn't valid JSON
+        return {**self.cache.stats(), 'ttl': None}